@@ -0,0 +1,57 @@
+"""
+Compares the memory used by IOEventStore against a defaultdict(list) of
+IOEvent tuples for a synthetic trace.
+
+    python benchmarks/bench_io_events.py [num_events]
+"""
+import random
+import sys
+import tracemalloc
+from collections import defaultdict
+
+from inliner.tracer import IOEvent, IOEventStore
+
+
+def make_events(n, num_names=50, num_lines=200, seed=0):
+    rng = random.Random(seed)
+    names = ['var{}'.format(i) for i in range(num_names)]
+    return [(rng.choice(names), rng.randrange(num_lines), rng.random() < 0.1)
+            for _ in range(n)]
+
+
+def fill_dict(events):
+    d = defaultdict(list)
+    for (name, line, in_closure) in events:
+        d[name].append(IOEvent(line=line, in_closure=in_closure))
+    return d
+
+
+def fill_store(events):
+    store = IOEventStore()
+    for (name, line, in_closure) in events:
+        store.append(name, line, in_closure)
+    return store
+
+
+def measure(fill, events):
+    tracemalloc.start()
+    obj = fill(events)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    events = make_events(n)
+
+    for label, fill in [('defaultdict(list)', fill_dict),
+                        ('IOEventStore', fill_store)]:
+        size = measure(fill, events)
+        print('{:>20}: {:8.1f} MB ({:.1f} bytes/event)'.format(
+            label, size / 2**20, size / n))
+
+
+if __name__ == '__main__':
+    main()
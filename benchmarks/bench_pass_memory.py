@@ -0,0 +1,54 @@
+"""
+Compares the peak memory and time of running a pass on a large program with
+and without deep copying the module for metadata resolution.
+
+    python benchmarks/bench_pass_memory.py [num_lines]
+"""
+import sys
+import time
+import tracemalloc
+
+import libcst as cst
+
+import inliner.inliner as inliner_module
+from inliner import Inliner
+from inliner.passes import RemoveSuffixesPass
+
+
+def make_program(num_lines):
+    stmts = []
+    for i in range(num_lines // 3):
+        stmts.append(f'x{i} = {i}\nif x{i} >= 0:\n    y{i} = x{i} + 1\n')
+    return ''.join(stmts)
+
+
+def measure(program):
+    i = Inliner(program)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    i.run_pass(RemoveSuffixesPass)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    program = make_program(num_lines)
+
+    skip_copy = inliner_module.metadata_wrapper
+    always_copy = lambda module: cst.MetadataWrapper(module)
+
+    for label, wrapper in [('deep copy', always_copy),
+                           ('skip copy', skip_copy)]:
+        inliner_module.metadata_wrapper = wrapper
+        elapsed, peak = measure(program)
+        print('{:>10}: {:6.2f}s, peak {:7.1f} MB'.format(
+            label, elapsed, peak / 2**20))
+    inliner_module.metadata_wrapper = skip_copy
+
+
+if __name__ == '__main__':
+    main()
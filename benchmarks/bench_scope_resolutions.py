@@ -0,0 +1,110 @@
+"""
+Counts the metadata resolutions (MetadataWrapper.resolve calls) made while
+inlining, per provider, on the seaborn boxplot program from the stress tests.
+Falls back to the json program if seaborn isn't installed.
+
+Inlining runs twice: "before" renames the arguments and locals of an inlined
+function one name at a time, with a scope resolution each, and "after" uses
+the current bulk renaming.
+
+    python benchmarks/bench_scope_resolutions.py
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import libcst as cst
+
+import inliner.transforms as transforms
+from inliner import Inliner
+from inliner.cache import SOURCE_CACHE
+from inliner.visitors import rename
+
+
+def resolution_counter():
+    counts = Counter()
+    resolve = cst.MetadataWrapper.resolve
+
+    def counting_resolve(self, provider):
+        counts[provider.__name__] += 1
+        return resolve(self, provider)
+
+    cst.MetadataWrapper.resolve = counting_resolve
+    return counts, lambda: setattr(cst.MetadataWrapper, 'resolve', resolve)
+
+
+@contextmanager
+def per_name_renames():
+    """
+    Renames names in inlined functions one at a time, as before bulk_rename.
+    """
+    rename_in_function = transforms.rename_in_function
+
+    def sequential_rename_in_function(f_ast, targets):
+        for src, dst in targets:
+            mod = cst.Module(body=f_ast.body.body)
+            f_ast = f_ast.with_deep_changes(f_ast.body,
+                                            body=rename(mod, src, dst).body)
+        return f_ast
+
+    transforms.rename_in_function = sequential_rename_in_function
+    try:
+        yield
+    finally:
+        transforms.rename_in_function = rename_in_function
+
+
+def stress_program():
+    try:
+        import matplotlib
+        matplotlib.use('agg')
+        import seaborn as sns
+        tips = sns.load_dataset('tips')
+
+        def prog():
+            sns.boxplot(x=tips.day, y=tips.tip)
+
+        return 'seaborn', prog, sns, {'sns': sns, 'tips': tips}
+    except ImportError:
+        import json
+
+        def prog():
+            assert json.dumps({}) == '{}'
+
+        return 'json', prog, json, {'json': json}
+
+
+def count_resolutions():
+    name, prog, target, globls = stress_program()
+
+    # Both runs parse the inlined functions from scratch
+    SOURCE_CACHE.clear()
+    i = Inliner(prog, globls=globls)
+    i.add_target(target)
+
+    counts, restore = resolution_counter()
+    start = time.perf_counter()
+    try:
+        i.fixpoint(lambda: i.run_pass('inline') | i.optimize())
+    finally:
+        restore()
+
+    return name, time.perf_counter() - start, counts, i.code()
+
+
+def main():
+    with per_name_renames():
+        name, before_time, before, before_code = count_resolutions()
+    _, after_time, after, after_code = count_resolutions()
+    assert before_code == after_code
+
+    print('{} program: {:.2f}s before, {:.2f}s after'.format(
+        name, before_time, after_time))
+    print('{:>32}  {:>8}  {:>8}'.format('provider', 'before', 'after'))
+    for provider, count in (before + after).most_common():
+        print('{:>32}  {:>8}  {:>8}'.format(provider, before[provider],
+                                            after[provider]))
+
+
+if __name__ == '__main__':
+    main()
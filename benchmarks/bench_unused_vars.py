@@ -0,0 +1,56 @@
+"""
+Times the unused write analysis of UnusedVarsVisitor on a synthetic trace
+with heavy re-assignment, against the previous quadratic scan.
+
+    python benchmarks/bench_unused_vars.py [num_events] [--compare]
+"""
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from inliner.tracer import IOEventStore, UnusedVarsVisitor
+
+
+def make_trace(n, num_names=10, num_lines=1000, seed=0):
+    rng = random.Random(seed)
+    writes, reads = IOEventStore(), IOEventStore()
+    for _ in range(n):
+        events = writes if rng.random() < 0.5 else reads
+        events.append('var{}'.format(rng.randrange(num_names)),
+                      rng.randrange(num_lines), False)
+    return SimpleNamespace(aggregate_reads=False, writes=writes, reads=reads)
+
+
+def quadratic_unused_lines(tracer):
+    unused_lines = set()
+    for k, writes in tracer.writes.items():
+        reads = tracer.reads[k]
+        for i, cur_write in enumerate(writes):
+            next_write_line = min([
+                w.line for w in writes[i + 1:] if w.line > cur_write.line
+            ],
+                                  default=sys.maxsize)
+            if not any((cur_write.line < r.line <= next_write_line)
+                       or r.in_closure for r in reads):
+                unused_lines.add(cur_write.line)
+    return unused_lines
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    n = int(args[0]) if args else 100000
+    tracer = make_trace(n)
+
+    start = time.perf_counter()
+    unused_lines = UnusedVarsVisitor(tracer).unused_lines
+    print('UnusedVarsVisitor: {:.3f}s'.format(time.perf_counter() - start))
+
+    if '--compare' in sys.argv:
+        start = time.perf_counter()
+        assert quadratic_unused_lines(tracer) == unused_lines
+        print('quadratic scan: {:.3f}s'.format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
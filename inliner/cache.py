@@ -0,0 +1,281 @@
+import hashlib
+import inspect
+import json
+import os
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A mapping with a bounded number of entries. When full, the least recently
+    used entry is evicted. Lookups through get() are counted as hits or
+    misses.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+
+def source_mtime(path):
+    """
+    Modification time of a source file, or None for source that doesn't live
+    on disk (e.g. registered in linecache by the tracer).
+    """
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+
+def function_cache_key(func_obj):
+    """
+    Key identifying the source of a function: the code object that
+    inspect.getsource would read. Returns None for objects without a code
+    object.
+    """
+    func_obj = inspect.unwrap(func_obj)
+    if inspect.ismethod(func_obj):
+        func_obj = func_obj.__func__
+    return getattr(func_obj, '__code__', None)
+
+
+class SourceCache:
+    """
+    An LRUCache of values derived from source files, e.g. parsed functions or
+    the imports of a module. Each entry remembers the mtime of its file, so
+    an entry for a file edited since is dropped and counts as a miss.
+
+    Entries are keyed by a kind (e.g. 'function') and a key within that
+    kind, and hits and misses are counted per kind.
+    """
+    def __init__(self, maxsize=512):
+        self._cache = LRUCache(maxsize=maxsize)
+        self.kinds = {}
+        self.invalidations = 0
+
+    def get(self, kind, key, path):
+        counts = self.kinds.setdefault(kind, {'hits': 0, 'misses': 0})
+        entry = self._cache.get((kind, key))
+        if entry is not None:
+            mtime, value = entry
+            if mtime == source_mtime(path):
+                counts['hits'] += 1
+                return value
+            del self._cache[(kind, key)]
+            self.invalidations += 1
+
+        counts['misses'] += 1
+        return None
+
+    def set(self, kind, key, path, value):
+        self._cache[(kind, key)] = (source_mtime(path), value)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache.clear()
+        self.kinds = {}
+        self.invalidations = 0
+
+    def stats(self, kind=None):
+        """
+        Hits and misses of one kind, or of all kinds along with the size of
+        the cache if kind is None.
+        """
+        if kind is not None:
+            return dict(self.kinds.get(kind, {'hits': 0, 'misses': 0}))
+        return {
+            'hits': sum(c['hits'] for c in self.kinds.values()),
+            'misses': sum(c['misses'] for c in self.kinds.values()),
+            'invalidations': self.invalidations,
+            'size': len(self._cache),
+            'maxsize': self._cache.maxsize,
+            'kinds': {kind: dict(c)
+                      for kind, c in self.kinds.items()}
+        }
+
+
+# Parsed function definitions and module imports, shared across Inliners
+# since libcst nodes are immutable
+SOURCE_CACHE = SourceCache(maxsize=512)
+
+
+def cache_dir():
+    """
+    Directory of caches that persist across processes. Defaults to
+    ~/.cache/inliner, and can be changed with the INLINER_CACHE_DIR
+    environment variable.
+    """
+    directory = os.environ.get('INLINER_CACHE_DIR')
+    if not directory:
+        directory = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+            'inliner')
+    return directory
+
+
+class DiskCache:
+    """
+    A persistent cache of values computed from source files, stored as one
+    JSON file per entry.
+
+    An entry is keyed by the size and a hash of the contents of the source
+    file it was computed from, so it's ignored once the file changes (e.g.
+    a new version of a library, even if it kept its mtimes). When the entries take more
+    than max_bytes, the least recently used ones are deleted. Errors reading
+    or writing the directory (e.g. a read-only home) are ignored, so the
+    cache only ever makes things faster.
+    """
+    def __init__(self, name, max_bytes=16 * 2**20):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self):
+        return os.path.join(cache_dir(), self.name)
+
+    def _entry_path(self, key, stamp):
+        digest = hashlib.sha1(json.dumps([key, stamp]).encode('utf-8'))
+        return os.path.join(self.directory, f'{digest.hexdigest()}.json')
+
+    @staticmethod
+    def _source_stamp(path):
+        try:
+            with open(path, 'rb') as f:
+                contents = f.read()
+        except (OSError, TypeError, ValueError):
+            return None
+        return [len(contents), hashlib.sha1(contents).hexdigest()]
+
+    def get(self, key, path):
+        """
+        Returns the value stored for key, if it was computed from the current
+        version of the file at path.
+        """
+        stamp = self._source_stamp(path)
+        if stamp is None:
+            self.misses += 1
+            return None
+
+        entry_path = self._entry_path(key, stamp)
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+
+        if entry is None or entry.get('key') != key or \
+                entry.get('path') != path or entry.get('stamp') != stamp:
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return entry['value']
+
+    def set(self, key, path, value):
+        stamp = self._source_stamp(path)
+        if stamp is None:
+            return
+
+        entry_path = self._entry_path(key, stamp)
+        tmp_path = f'{entry_path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(
+                    {
+                        'key': key,
+                        'path': path,
+                        'stamp': stamp,
+                        'value': value
+                    },
+                    f,
+                    separators=(',', ':'))
+            os.replace(tmp_path, entry_path)
+            self.evict(keep=entry_path)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """
+        Deletes the least recently used entries (other than keep) until they
+        fit in max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json') and entry.path != keep:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    os.remove(entry.path)
+        except OSError:
+            pass
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
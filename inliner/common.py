@@ -1,8 +1,11 @@
+import dataclasses
+import inspect
 import re
 import textwrap
 
 import libcst as cst
 
+from .cache import SOURCE_CACHE, function_cache_key
 from .contexts import ctx_inliner
 
 SEP = "___"
@@ -82,3 +85,68 @@ def parse_statement(s):
 
 def parse_expr(s):
     return cst.parse_expression(dedent(s).strip())
+
+
+_NODE_FIELDS = {}
+
+
+def has_duplicate_nodes(tree):
+    """
+    Checks if the same node object occurs more than once in a tree, e.g.
+    because one expression was substituted in several places.
+
+    Reads dataclass fields directly, which is much cheaper than a visitor.
+    """
+    seen = set()
+    stack = [tree]
+    while len(stack) > 0:
+        node = stack.pop()
+        if id(node) in seen:
+            return True
+        seen.add(id(node))
+
+        fields = _NODE_FIELDS.get(type(node))
+        if fields is None:
+            fields = _NODE_FIELDS[type(node)] = [
+                f.name for f in dataclasses.fields(node)
+            ]
+
+        for field in fields:
+            value = getattr(node, field)
+            if isinstance(value, cst.CSTNode):
+                stack.append(value)
+            elif isinstance(value, (list, tuple)):
+                stack.extend(v for v in value if isinstance(v, cst.CSTNode))
+
+    return False
+
+
+def metadata_wrapper(module):
+    """
+    Wraps a module for metadata resolution without deep copying it, unless
+    the copy is needed to give every node a unique identity.
+    """
+    return cst.MetadataWrapper(module,
+                               unsafe_skip_copy=not has_duplicate_nodes(module))
+
+
+def parse_function(func_obj):
+    """
+    Returns the source of a function and its parsed definition, reusing the
+    results for functions that were parsed before.
+
+    A cached definition is returned as a copy, since inlining the function
+    at several call sites mustn't put the same nodes in the module twice.
+    """
+    code = function_cache_key(func_obj)
+    if code is not None:
+        entry = SOURCE_CACHE.get('function', code, code.co_filename)
+        if entry is not None:
+            source, fdef = entry
+            return source, fdef.deep_clone()
+
+    source = inspect.getsource(func_obj)
+    fdef = parse_statement(source)
+    if code is not None:
+        SOURCE_CACHE.set('function', code, code.co_filename, (source, fdef))
+    return source, fdef
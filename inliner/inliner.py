@@ -1,17 +1,38 @@
+import copy
 import inspect
+import logging as log
+from contextlib import contextmanager
+from functools import reduce
 
 import libcst as cst
 
-from .common import EvalException, a2s, get_function_locals, parse_module
+from .cache import SOURCE_CACHE, LRUCache
+from .common import (EvalException, a2s, get_function_locals, metadata_wrapper,
+                     parse_module)
 from .contexts import ctx_inliner, ctx_pass
 from .passes import (PASSES, CleanImportsPass, CopyPropagationPass,
                      DeadCodePass, InlinePass, RecordToVarsPass,
-                     RemoveSuffixesPass, UnusedVarsPass)
-from .targets import make_target
+                     RemoveSuffixesPass, UnusedVarsPass, fuse_passes)
+from .profiling import PassProfile, Profiler
+from .targets import TargetIndex, make_target
+from .tracer import (IncrementalTrace, StatementEffects, Tracer, TracerArgs,
+                     _fingerprint, _needs_checkpoint, compile_and_exec,
+                     register_source)
 
 
 class Inliner:
-    def __init__(self, program, globls=None, targets=None, add_comments=True):
+    def __init__(self,
+                 program,
+                 globls=None,
+                 targets=None,
+                 add_comments=True,
+                 trace_cache_size=16,
+                 profile=False,
+                 incremental_trace=False,
+                 setup_statements=0,
+                 fork_trace=False,
+                 max_trace_seconds=None,
+                 max_trace_lines=None):
         if type(program) is not str:
             assert inspect.isfunction(program)
             if globls is None and hasattr(program, '__globals__'):
@@ -23,36 +44,286 @@ class Inliner:
             source = program
             mod = parse_module(source)
 
-        self.module = mod
         self.base_globls = globls.copy() if globls is not None else {}
+
+        # The first setup_statements of the program (e.g. loading a dataset)
+        # are executed once, and every trace starts from a copy of the
+        # resulting globals. Passes only see the rest of the program.
+        self.setup_statements = setup_statements
+        self.setup_module = None
+        self.setup_names = []
+
+        # Setup values that an execution changed in place even though
+        # StatementEffects didn't see it, which are copied from then on
+        self.mutated_setup_names = set()
+        self.uncopyable_setup_names = set()
+        if setup_statements > 0:
+            self.setup_module = mod.with_changes(
+                body=mod.body[:setup_statements],
+                footer=[],
+                has_trailing_newline=True)
+            mod = mod.with_changes(body=mod.body[setup_statements:], header=[])
+            self.pre_setup_globls = self.base_globls.copy()
+            compile_and_exec(self.setup_module.code, self.base_globls)
+            self.setup_names = [
+                name for name, value in self.base_globls.items()
+                if (name not in self.pre_setup_globls
+                    or value is not self.pre_setup_globls[name])
+                and _needs_checkpoint(value)
+            ]
+
+        self.module = mod
         self.cur_globls = self.base_globls.copy()
 
         self.add_comments = add_comments
         self.length_inlined = 0
-        self.targets = targets if targets is not None else []
+        self.targets = [make_target(t) for t in targets
+                        ] if targets is not None else []
+        self.target_index = TargetIndex(self.targets)
+
+        # Incremented when targets change, which invalidates the inlining
+        # decisions memoized by passes
+        self.targets_version = 0
+        self.trace_cache = LRUCache(maxsize=trace_cache_size)
+        self.planned_tracer_args = None
+        self.scheduler_stats = {'runs': 0, 'saved': 0}
+        self.profiler = Profiler() if profile else None
+
+        # Last module output by a pass, which has no whitespace left to trim
+        self.trimmed_module = None
+
+        # Metadata wrappers of recent modules, so passes over a module that
+        # didn't change reuse the metadata resolved by earlier passes
+        self.metadata_cache = LRUCache(maxsize=4)
+
+        # Checkpoints of the last trace with each set of tracer arguments, if
+        # only the statements after the unchanged prefix of a program should
+        # be executed again
+        self.incremental_traces = {} if incremental_trace else None
+
+        # Whether to execute each trace in a forked process, so side effects
+        # of the program don't accumulate across traces
+        assert not (fork_trace and incremental_trace), \
+            "Incremental checkpoints can't be kept by a forked trace"
+        self.fork_trace = fork_trace
+
+        # Budgets of every trace. Passes are conservative about the code
+        # that a truncated trace didn't observe.
+        self.trace_budget = TracerArgs(max_seconds=max_trace_seconds,
+                                       max_lines=max_trace_lines)
+
+        # Source of evaluated expression nodes, and compiled code of
+        # evaluated expressions, since passes evaluate the same expressions
+        # (e.g. self, sns.boxplot) many times
+        self.expression_sources = LRUCache(maxsize=1024)
+        self.expression_codes = LRUCache(maxsize=1024)
 
     def _name_to_pass(self, name):
         return next(p for p in PASSES if p.name() == name)
 
     def run_pass(self, Pass, **kwargs):
-        orig_module = self.module
         with ctx_inliner.set(self):
             if isinstance(Pass, str):
                 Pass = self._name_to_pass(Pass)
             pass_ = Pass(**kwargs)
+            evals = self.expression_codes.hits + self.expression_codes.misses
+            eval_hits = self.expression_codes.hits
 
             with ctx_pass.set(pass_):
-                self.module = pass_.execute(self.module)
+                new_module = pass_.execute(self.module)
+
+                # Keep the same module object if nothing changed so its
+                # metadata stays cached
+                if pass_.changed:
+                    self.module = new_module
+                self.trimmed_module = self.module
+
+        if self.profiler is not None:
+            self.profiler.record(
+                PassProfile(pass_name=Pass.name(),
+                            trace_time=pass_.timings['trace'],
+                            metadata_time=pass_.timings['metadata'],
+                            transform_time=pass_.timings['transform'],
+                            trim_time=pass_.timings['trim'],
+                            nodes_visited=pass_.nodes_visited,
+                            changed=pass_.changed,
+                            evals=self.expression_codes.hits +
+                            self.expression_codes.misses - evals,
+                            eval_hits=self.expression_codes.hits - eval_hits))
+
+        return pass_.changed
+
+    def metadata_wrapper(self, module):
+        """
+        Returns a MetadataWrapper for the module, shared with earlier callers
+        that wrapped the same module object (or the wrapper's copy of it).
+        """
+        entry = self.metadata_cache.get(id(module))
+        if entry is not None:
+            return entry[1]
+
+        wrapper = metadata_wrapper(module)
+        self.metadata_cache[id(module)] = (module, wrapper)
+        if wrapper.module is not module:
+            self.metadata_cache[id(wrapper.module)] = (wrapper.module, wrapper)
+        return wrapper
+
+    def _globls_fingerprint(self):
+        # Cached tracers hold references to the values of base_globls, so
+        # object ids can't be reused while the cache entry is alive
+        return tuple((k, id(v)) for k, v in self.base_globls.items())
+
+    def trace(self, module, args):
+        """
+        Executes a module with the tracer.
+
+        If the same program was already traced with the same arguments and
+        globals, then the results of the earlier trace are reused instead of
+        re-running the program. With incremental_trace, a new program is
+        traced starting from the first top-level statement that changed.
+        """
+        if self.planned_tracer_args is not None:
+            args = args.union(self.planned_tracer_args)
+        args = args.union(self.trace_budget)
+
+        # Functions defined by the setup need its source to be inlined
+        if self.setup_module is not None:
+            register_source(self.setup_module.code)
 
-        return not orig_module.deep_equals(self.module)
+        tracer = Tracer(module, self.base_globls, args)
+        key = (tracer.transformed_module.code, args,
+               self._globls_fingerprint())
+
+        prev_tracer = self.trace_cache.get(key)
+        if prev_tracer is not None:
+            return tracer.reuse(prev_tracer)
+
+        if self.fork_trace:
+            tracer.trace_forked()
+        else:
+            copies = self.setup_copies(module)
+            tracer.globls.update(copies)
+            with self.checked_setup(copies):
+                tracer.trace(incremental=self._incremental_trace(args))
+        self.trace_cache[key] = tracer
+        return tracer
+
+    def setup_copies(self, module):
+        """
+        Fresh copies of the values defined by the setup statements that a
+        module may change in place (e.g. data.append(1)), so it sees the same
+        values in every execution. The other values are shared by every
+        execution instead of being copied. If a value can't be copied, the
+        setup statements are executed again.
+        """
+        if not self.setup_names:
+            return {}
+
+        effects = StatementEffects()
+        module.visit(effects)
+        changed = effects.changed_names(self.base_globls, effects.latent)
+        names = [
+            name for name in self.setup_names
+            if effects.dynamic or name in changed
+            or name in self.mutated_setup_names
+        ]
+        if not names:
+            return {}
+
+        # Values that weren't defined by the setup are shared, not copied
+        memo = {id(v): v for v in self.pre_setup_globls.values()}
+        copies = {}
+        for name in names:
+            try:
+                copies[name] = copy.deepcopy(self.base_globls[name], memo)
+            except Exception as e:
+                if name not in self.uncopyable_setup_names:
+                    self.uncopyable_setup_names.add(name)
+                    log.warning(
+                        f'Setup value {name} can\'t be copied ({e!r}), so '
+                        'the setup statements are executed again for every '
+                        'trace that may change it')
+                globls = self.pre_setup_globls.copy()
+                compile_and_exec(self.setup_module.code, globls)
+                return {name: globls[name] for name in names}
+        return copies
+
+    @contextmanager
+    def checked_setup(self, copies):
+        """
+        Executes the setup statements again if the setup values shared by an
+        execution were changed in place, e.g. through a loop variable.
+        """
+        shared = [name for name in self.setup_names if name not in copies]
+        before = {
+            name: _fingerprint({name: self.base_globls[name]}, {})
+            for name in shared
+        }
+        try:
+            yield
+        finally:
+            mutated = {
+                name
+                for name in shared if before[name] != _fingerprint(
+                    {name: self.base_globls[name]}, {})
+            }
+            if mutated:
+                self.mutated_setup_names |= mutated
+                globls = self.pre_setup_globls.copy()
+                compile_and_exec(self.setup_module.code, globls)
+                for name in self.setup_names:
+                    self.base_globls[name] = globls[name]
+
+    def _incremental_trace(self, args):
+        if self.incremental_traces is None:
+            return None
+
+        fingerprint = self._globls_fingerprint()
+        entry = self.incremental_traces.get(args)
+        if entry is None or entry[0] != fingerprint:
+            entry = self.incremental_traces[args] = (
+                fingerprint, IncrementalTrace(self.base_globls))
+        return entry[1]
+
+    def plan_tracer_args(self, passes):
+        """
+        Computes tracer arguments that satisfy every pass in a sequence.
+        """
+        passes = [
+            self._name_to_pass(Pass) if isinstance(Pass, str) else Pass
+            for Pass in passes
+        ]
+        args = [
+            Pass.tracer_args for Pass in passes if Pass.tracer_args is not None
+        ]
+        return reduce(TracerArgs.union, args, TracerArgs())
+
+    @contextmanager
+    def trace_plan(self, passes):
+        """
+        Makes every trace collect what any pass in the sequence needs.
+
+        Each version of the module is then executed once, and passes that
+        see the same module share the cached trace.
+        """
+        prev_args = self.planned_tracer_args
+        self.planned_tracer_args = self.plan_tracer_args(passes)
+        try:
+            yield
+        finally:
+            self.planned_tracer_args = prev_args
 
     def add_target(self, target):
         target = make_target(target)
         self.targets.append(target)
+        self.target_index.add(target)
+        self.targets_version += 1
         return target
 
     def remove_target(self, target):
         self.targets.remove(target)
+        self.target_index.remove(target)
+        self.targets_version += 1
 
     def optimize(self, passes=None):
         if passes is None:
@@ -60,42 +331,128 @@ class Inliner:
                 InlinePass,
                 DeadCodePass,
                 CopyPropagationPass,
-                UnusedVarsPass,
-                CleanImportsPass,
+                # Unused variable removal and import cleanup don't interact, so
+                # they share one walk
+                fuse_passes(UnusedVarsPass, CleanImportsPass),
             ]
 
-        def run_passes():
-            any_change = False
-            for Pass in passes:
-                any_change |= self.run_pass(Pass)
-            return any_change
+        with self.trace_plan(
+                list(passes) + [RecordToVarsPass, RemoveSuffixesPass]):
+            return (self.run_passes(passes)
+                    | self.run_pass(RecordToVarsPass)
+                    | self.run_passes(passes)
+                    | self.run_pass(RemoveSuffixesPass))
+
+    def run_passes(self, passes):
+        """
+        Runs passes in order, round-robin, until none of them can change the
+        module. Same result as a fixpoint over rounds of all the passes, but a
+        pass is only run again after a pass in its enabled_by has changed the
+        module.
+
+        Counts of passes run and of runs saved compared to the fixpoint are
+        accumulated in scheduler_stats.
+        """
+        passes = [
+            self._name_to_pass(Pass) if isinstance(Pass, str) else Pass
+            for Pass in passes
+        ]
 
-        return (self.fixpoint(run_passes) | self.run_pass(RecordToVarsPass)
-                | self.fixpoint(run_passes) | self.run_pass(RemoveSuffixesPass))
+        queued = [True] * len(passes)
+        last_change_round = None
+        runs = 0
+        i = 0
+        while any(queued):
+            Pass = passes[i % len(passes)]
+            if queued[i % len(passes)]:
+                queued[i % len(passes)] = False
+                runs += 1
+
+                if self.run_pass(Pass):
+                    last_change_round = i // len(passes)
+                    for j, Other in enumerate(passes):
+                        if Other.enabled_by is None or any(
+                                name in Other.enabled_by
+                                for name in Pass.pass_names()):
+                            queued[j] = True
+            i += 1
+
+        # The fixpoint finishes the round of the last change, then runs one
+        # more round without changes
+        fixpoint_rounds = 1 if last_change_round is None \
+            else last_change_round + 2
+        self.scheduler_stats['runs'] += runs
+        self.scheduler_stats['saved'] += fixpoint_rounds * len(passes) - runs
+
+        return last_change_round is not None
 
     def fixpoint(self, f, *args, **kwargs):
         any_change = False
         while True:
             changed = f(*args, **kwargs)
-            any_change |= any_change
+            any_change |= changed
             if not changed:
                 return any_change
 
     def code(self):
+        if self.setup_module is not None:
+            return self.setup_module.code + self.module.code
         return self.module.code
 
-    def eval(self, code, globls=None):
+    def eval(self, code, globls=None, unknown=()):
+        """
+        Evaluates an expression in the globals of a trace. Expressions that
+        use one of the unknown names (e.g. the dropped_names of a forked
+        trace) raise an EvalException, like undefined names.
+        """
         if isinstance(code, cst.CSTNode):
-            code = a2s(code)
+            node = code
+            code = self.expression_sources.get(node)
+            if code is None:
+                code = self.expression_sources[node] = a2s(node)
         assert isinstance(code, str)
 
         globls = globls.copy() if globls is not None else self.base_globls
 
         try:
-            return eval(code, globls, globls)
+            compiled = self.expression_codes.get(code)
+            if compiled is None:
+                compiled = self.expression_codes[code] = compile(
+                    code, '<string>', 'eval')
+            for name in compiled.co_names:
+                if name in unknown:
+                    raise NameError(f'value of {name} is unknown')
+            return eval(compiled, globls, globls)
         except Exception as e:
             raise EvalException(e)
 
+    def cache_stats(self):
+        """
+        Statistics of the caches used by this Inliner. The source cache
+        (parsed functions and module imports) is shared by all Inliners.
+        """
+        return {
+            'source': SOURCE_CACHE.stats(),
+            'trace': self.trace_cache.stats(),
+            'metadata': self.metadata_cache.stats(),
+            'expressions': self.expression_codes.stats()
+        }
+
+    def clear_caches(self):
+        """
+        Empties the caches of this Inliner and the shared source cache, e.g.
+        to release memory in a long-lived kernel.
+        """
+        SOURCE_CACHE.clear()
+        self.trace_cache.clear()
+        self.metadata_cache.clear()
+        self.expression_sources.clear()
+        self.expression_codes.clear()
+        if self.incremental_traces is not None:
+            self.incremental_traces.clear()
+
     def execute(self):
-        globls = self.base_globls.copy()
-        exec(self.module.code, globls, globls)
+        copies = self.setup_copies(self.module)
+        globls = {**self.base_globls, **copies}
+        with self.checked_setup(copies):
+            exec(self.module.code, globls, globls)
@@ -11,7 +11,7 @@ from .contexts import ctx_inliner
 from .inliner import Inliner
 from .passes.base_pass import BasePass
 from .targets import CursorTarget, InlineTarget
-from .tracer import Tracer, TracerArgs
+from .tracer import TracerArgs
 
 
 def object_path(obj):
@@ -38,15 +38,16 @@ def object_path(obj):
 class CollectTargetSuggestions(cst.CSTVisitor):
     METADATA_DEPENDENCIES = (ScopeProvider, )
 
-    def __init__(self, inliner, globls):
+    def __init__(self, inliner, tracer):
         self.inliner = inliner
-        self.globls = globls
+        self.tracer = tracer
         self.suggestions = {}
 
     def _visit(self, node):
 
         try:
-            obj = self.inliner.eval(node, self.globls)
+            obj = self.inliner.eval(node, self.tracer.globls,
+                                    self.tracer.dropped_names)
         except EvalException:
             return
 
@@ -142,31 +143,27 @@ class InteractiveInliner(Inliner):
         if ret:
             self.history.append(
                 RunPassHistory(prev_module=prev_module, pass_=Pass))
-            self.targets = [
-                t for t in self.targets if not isinstance(t, CursorTarget)
-            ]
+            for target in list(self.targets):
+                if isinstance(target, CursorTarget):
+                    self.remove_target(target)
         return ret
 
     def target_suggestions(self):
         with ctx_inliner.set(self):
-            globls = Tracer(self.module, globls=self.base_globls).trace().globls
-            collector = CollectTargetSuggestions(self, globls)
+            tracer = self.trace(self.module, TracerArgs())
+            collector = CollectTargetSuggestions(self, tracer)
             cst.MetadataWrapper(self.module).visit(collector)
             return collector.suggestions
 
     def code_folding(self):
-        tracer = Tracer(self.module,
-                        globls=self.base_globls,
-                        args=TracerArgs(trace_lines=True)).trace()
+        tracer = self.trace(self.module, TracerArgs(trace_lines=True))
         finder = FindUnexecutedBlocks(tracer)
         cst.MetadataWrapper(self.module, unsafe_skip_copy=True).visit(finder)
         return sorted(finder.unexecuted)
 
     def code_viewer(self):
         from .jupyter import CodeViewer
-        tracer = Tracer(self.module,
-                        globls=self.base_globls,
-                        args=TracerArgs(trace_lines=True)).trace()
+        tracer = self.trace(self.module, TracerArgs(trace_lines=True))
         counts = tracer.exec_counts()
         positions = cst.MetadataWrapper(self.module, unsafe_skip_copy=True).resolve(ByteSpanPositionProvider)
 
@@ -190,7 +187,12 @@ class InteractiveInliner(Inliner):
 
     def debug(self):
         with ctx_inliner.set(self):
-            f_body = textwrap.indent(a2s(self.orig_module).rstrip(), ' ' * 4)
+            source = a2s(self.orig_module)
+            if self.setup_module is not None:
+                source = self.setup_module.code + source
+            f_body = textwrap.indent(source.rstrip(), ' ' * 4)
+            args = 'f' if self.setup_statements == 0 else \
+                f'f, setup_statements={self.setup_statements}'
 
             passes = '\n'.join([entry.to_code('i') for entry in self.history])
 
@@ -201,7 +203,7 @@ from inliner.targets import CursorTarget
 def f():
 {f_body}
 
-i = InteractiveInliner(f)
+i = InteractiveInliner({args})
 {passes}
 
 print(i.code())
@@ -1,4 +1,4 @@
-from .base_pass import BasePass
+from .base_pass import BasePass, fuse_passes
 from .inline import InlinePass
 from .deadcode import DeadCodePass
 from .copy_propagation import CopyPropagationPass
@@ -1,19 +1,26 @@
-import os
 import inspect
 from collections import defaultdict
-from typing import Optional, DefaultDict
+from contextlib import contextmanager
+from functools import lru_cache, reduce
+from typing import Optional, DefaultDict, Tuple
 import re
+import time
 import libcst as cst
 import libcst.matchers as m
 from libcst.metadata import PositionProvider
 
 from ..visitors import InsertStatementsVisitor
 from ..contexts import ctx_inliner
-from ..tracer import Tracer, TRACER_FILE_PREFIX, TracerArgs
+from ..tracer import Tracer, TracerArgs, is_tracer_source
 
 
 class TrimWhitespace(cst.CSTTransformer):
-    def _filter_lines(self, lines):
+    def __init__(self):
+        super().__init__()
+        self.changed = False
+
+    @staticmethod
+    def _filter_lines(lines):
         return [
             line for i, line in enumerate(lines)
             if line.comment is not None or (
@@ -30,6 +37,8 @@ class TrimWhitespace(cst.CSTTransformer):
                     if line.strip() != '':
                         final = line
                         break
+                if final != s[3:-3]:
+                    self.changed = True
                 return updated_node.with_changes(
                     value=cst.SimpleString(f'"""{final}"""'))
         return updated_node
@@ -37,13 +46,20 @@ class TrimWhitespace(cst.CSTTransformer):
     def on_leave(self, original_node, updated_node):
         final_node = super().on_leave(original_node, updated_node)
         if hasattr(final_node, 'leading_lines'):
-            return final_node.with_changes(
-                leading_lines=self._filter_lines(final_node.leading_lines))
+            leading_lines = self._filter_lines(final_node.leading_lines)
+            if len(leading_lines) != len(final_node.leading_lines):
+                self.changed = True
+            return final_node.with_changes(leading_lines=leading_lines)
         return final_node
 
 
 class BasePass(InsertStatementsVisitor):
     tracer_args: Optional[TracerArgs] = None
+
+    # Names of the passes whose changes can give this pass something new to
+    # do. None means a change by any pass.
+    enabled_by: Optional[Tuple[str, ...]] = None
+
     tracer: Optional[Tracer]
     generated_vars: DefaultDict[str, int]
 
@@ -55,9 +71,23 @@ class BasePass(InsertStatementsVisitor):
         self.generated_vars = defaultdict(int)
         self.tracer = None
 
+        # Whether the pass modified the module. Set whenever a statement is
+        # inserted, or a node is removed or replaced.
+        self.changed = False
+
+        # Instrumentation of the last execute, see Inliner.profiler
+        self.nodes_visited = 0
+        self.fuse_trim = False
+        self.timings = defaultdict(float)
+
+        # Decisions of should_inline by object id and targets version
+        self.inline_decisions = {}
+
     def eval(self, code):
-        return self.inliner.eval(
-            code, self.tracer.globls if self.tracer_args is not None else None)
+        if self.tracer_args is None:
+            return self.inliner.eval(code)
+        return self.inliner.eval(code, self.tracer.globls,
+                                 self.tracer.dropped_names)
 
     def is_source_obj(self, obj):
         """
@@ -67,7 +97,7 @@ class BasePass(InsertStatementsVisitor):
         """
         try:
             srcfile = inspect.getfile(obj)
-            if os.path.basename(srcfile).startswith(TRACER_FILE_PREFIX):
+            if is_tracer_source(srcfile):
                 return True
         except TypeError:
             pass
@@ -77,9 +107,43 @@ class BasePass(InsertStatementsVisitor):
     def should_inline(self, code):
         """
         Checks whether an AST node is something to be inlined.
+
+        The decision for an object is memoized for the rest of the pass,
+        except for targets that depend on the expression (see
+        InlineTarget.depends_on_code).
         """
 
         obj = self.eval(code)
+
+        # A bound method is created on every access, so it's identified by
+        # its function and instance. The identifying objects are kept so
+        # their ids aren't reused during the pass.
+        if inspect.ismethod(obj):
+            identity = (obj.__func__, obj.__self__)
+            key = (id(obj.__func__), id(obj.__self__),
+                   self.inliner.targets_version)
+        else:
+            identity = obj
+            key = (id(obj), self.inliner.targets_version)
+
+        entry = self.inline_decisions.get(key)
+        if entry is None:
+            decision = self._should_inline_obj(code, obj)
+            entry = self.inline_decisions[key] = (identity, decision)
+
+        decision = entry[1]
+        if decision is not None:
+            return decision
+
+        return any(
+            target.should_inline(code, obj)
+            for target in self.inliner.target_index.code_dependent(obj))
+
+    def _should_inline_obj(self, code, obj):
+        """
+        Decides whether to inline an object, or returns None if that's up to
+        the targets that depend on the expression.
+        """
         module = inspect.getmodule(obj)
 
         # Unconditionally inline objects defined in the source
@@ -94,11 +158,11 @@ class BasePass(InsertStatementsVisitor):
         if module is None:
             return False
 
-        for target in self.inliner.targets:
-            if target.should_inline(code, obj):
-                return True
+        target_index = self.inliner.target_index
+        if target_index.should_inline(code, obj):
+            return True
 
-        return False
+        return None if target_index.code_dependent(obj) else False
 
     def fresh_var(self, prefix):
         """
@@ -111,6 +175,33 @@ class BasePass(InsertStatementsVisitor):
         else:
             return f'{prefix}_{count}'
 
+    def insert_statements_before_current(self, stmts):
+        if len(stmts) > 0:
+            self.changed = True
+        super().insert_statements_before_current(stmts)
+
+    def insert_statements_after_current(self, stmts):
+        if len(stmts) > 0:
+            self.changed = True
+        super().insert_statements_after_current(stmts)
+
+    def on_visit(self, node):
+        self.nodes_visited += 1
+        return super().on_visit(node)
+
+    def on_leave(self, original_node, updated_node):
+        final_node = super().on_leave(original_node, updated_node)
+
+        # Statements, blocks and modules are always rebuilt by
+        # InsertStatementsVisitor, so only their removal is a change
+        if isinstance(final_node, cst.RemovalSentinel) or (
+                final_node is not updated_node and not isinstance(
+                    updated_node,
+                    (cst.BaseStatement, cst.BaseSuite, cst.Module))):
+            self.changed = True
+
+        return final_node
+
     def visit_FunctionDef(self, node) -> bool:
         super().visit_FunctionDef(node)
         # Don't recurse into inline function definitions
@@ -119,13 +210,65 @@ class BasePass(InsertStatementsVisitor):
     def visit_Module(self, node) -> None:
         super().visit_Module(node)
         if self.tracer_args:
-            self.tracer = Tracer(node, self.inliner.base_globls,
-                                 self.tracer_args).trace()
+            with self.timed('trace'):
+                self.tracer = self.inliner.trace(node, self.tracer_args)
             self.globls = self.tracer.globls
 
+    @contextmanager
+    def timed(self, bucket):
+        """
+        Adds the time spent in the block to a bucket of self.timings, e.g.
+        'metadata' for metadata a pass resolves during its walk.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[bucket] += time.perf_counter() - start
+
+    def finalize_statement(self, stmt, inserted):
+        if not self.fuse_trim:
+            return stmt
+
+        if inserted:
+            return stmt.visit(TrimWhitespace())
+
+        leading_lines = TrimWhitespace._filter_lines(stmt.leading_lines)
+        if len(leading_lines) != len(stmt.leading_lines):
+            self.changed = True
+            return stmt.with_changes(leading_lines=leading_lines)
+        return stmt
+
     def execute(self, module):
-        module = cst.MetadataWrapper(module).visit(self)
-        return module.visit(TrimWhitespace())
+        # If the module is the trimmed output of the previous pass, then only
+        # inserted statements and merged comments can need trimming, which is
+        # done in finalize_statement during the walk. Otherwise, trim the
+        # whole module afterwards.
+        self.fuse_trim = module is self.inliner.trimmed_module
+
+        start = time.perf_counter()
+        wrapper = self.inliner.metadata_wrapper(module)
+        wrapper.resolve_many(self.get_inherited_dependencies())
+        metadata_end = time.perf_counter()
+
+        # Tracing and metadata resolved during the walk aren't part of the
+        # transform
+        nested_start = self.timings['trace'] + self.timings['metadata']
+        module = wrapper.visit(self)
+        transform_end = time.perf_counter()
+        nested = self.timings['trace'] + self.timings['metadata'] - \
+            nested_start
+
+        if not self.fuse_trim:
+            trim = TrimWhitespace()
+            module = module.visit(trim)
+            self.changed |= trim.changed
+        trim_end = time.perf_counter()
+
+        self.timings['metadata'] += metadata_end - start
+        self.timings['transform'] += transform_end - metadata_end - nested
+        self.timings['trim'] += trim_end - transform_end
+        return module
 
     @classmethod
     def name(cls) -> str:
@@ -140,3 +283,56 @@ class BasePass(InsertStatementsVisitor):
 
         # Make "the_foo"
         return '_'.join([s.lower() for s in parts])
+
+    @classmethod
+    def pass_names(cls) -> Tuple[str, ...]:
+        """
+        Names of the passes this pass performs, more than one if fused.
+        """
+        return (cls.name(), )
+
+
+VISITOR_METHOD_PREFIXES = ('visit_', 'leave_', 'on_visit', 'on_leave')
+
+
+@lru_cache(maxsize=None)
+def fuse_passes(*Passes):
+    """
+    Creates a pass that performs each of Passes in a single walk over the
+    module, with metadata resolved once.
+
+    The passes must not override the same visitor methods, since all of their
+    methods are combined into one class. Fusing is only valid if running the
+    passes at once gives the same result as running them in order, e.g.
+    because they touch disjoint kinds of nodes.
+    """
+    seen = {}
+    for Pass in Passes:
+        for Base in Pass.__mro__:
+            if Base is BasePass:
+                break
+            for attr in Base.__dict__:
+                if attr.startswith(VISITOR_METHOD_PREFIXES):
+                    other = seen.setdefault(attr, Pass)
+                    assert other is Pass, \
+                        f'{Pass.__name__} and {other.__name__} both define {attr}'
+
+    tracer_args = [
+        Pass.tracer_args for Pass in Passes if Pass.tracer_args is not None
+    ]
+    if any(Pass.enabled_by is None for Pass in Passes):
+        enabled_by = None
+    else:
+        enabled_by = tuple(
+            dict.fromkeys(name for Pass in Passes for name in Pass.enabled_by))
+    names = tuple(name for Pass in Passes for name in Pass.pass_names())
+
+    return type(
+        ''.join(Pass.__name__ for Pass in Passes), Passes, {
+            'tracer_args':
+            reduce(lambda a, b: a.union(b), tracer_args)
+            if len(tracer_args) > 0 else None,
+            'enabled_by': enabled_by,
+            'name': classmethod(lambda cls: '+'.join(names)),
+            'pass_names': classmethod(lambda cls: names)
+        })
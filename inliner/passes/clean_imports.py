@@ -1,7 +1,11 @@
 import libcst as cst
 from isort import SortImports
 
-from .base_pass import BasePass
+from .base_pass import BasePass, TrimWhitespace
+
+
+def _is_import(node):
+    return isinstance(node, (cst.Import, cst.ImportFrom))
 
 
 class CleanImportsPass(BasePass):
@@ -20,10 +24,25 @@ class CleanImportsPass(BasePass):
       x = 1
       y = foo.bar() + x
     """
+
+    # Only inlining adds imports, and only dead code elimination removes them
+    enabled_by = ('inline', 'dead_code')
+
     def __init__(self):
         super().__init__()
         self.imports = []
 
+    def on_leave(self, original_node, updated_node):
+        # Removing imports is only a change if they don't come back in the
+        # same place, which is checked in leave_Module
+        changed = self.changed
+        final_node = super().on_leave(original_node, updated_node)
+        if _is_import(original_node) or (
+                isinstance(original_node, cst.SimpleStatementLine)
+                and all(_is_import(stmt) for stmt in original_node.body)):
+            self.changed = changed
+        return final_node
+
     def leave_Import(self, original_node, updated_node):
         self.imports.append(original_node)
         return cst.RemoveFromParent()
@@ -37,9 +56,35 @@ class CleanImportsPass(BasePass):
         imports_str = cst.Module(
             body=[cst.SimpleStatementLine([i]) for i in self.imports]).code
         sorted_imports = cst.parse_module(
-            SortImports(file_contents=imports_str).output)
+            SortImports(file_contents=imports_str).output).visit(
+                TrimWhitespace())
 
         # Add imports back to the top of the module
-        new_body = sorted_imports.body + list(final_node.body)
+        new_body = list(sorted_imports.body) + list(final_node.body)
+        self.changed |= not self._is_sorted_prefix(
+            original_node, new_body, len(sorted_imports.body))
 
         return final_node.with_changes(body=new_body)
+
+    def _is_sorted_prefix(self, original_node, new_body, num_imports):
+        """
+        Checks if the module already started with exactly the sorted imports,
+        without comparing the rest of the module.
+        """
+        orig_body = original_node.body
+        if len(orig_body) != len(new_body):
+            return False
+
+        # All imports must have come from the top of the module, and the
+        # statement after them must not have picked up their comments
+        prefix = orig_body[:num_imports]
+        num_prefix_imports = sum(
+            len(stmt.body) for stmt in prefix
+            if isinstance(stmt, cst.SimpleStatementLine))
+        if num_prefix_imports != len(self.imports):
+            return False
+
+        return all(
+            orig.deep_equals(new)
+            for orig, new in zip(orig_body[:num_imports + 1],
+                                 new_body[:num_imports + 1]))
@@ -19,7 +19,11 @@ class PropagationPass(BasePass):
         return True
 
     def leave_Name(self, original_node, updated_node):
-        return self._to_propagate.get(original_node, updated_node)
+        if original_node in self._to_propagate:
+            # Clone so the module doesn't share one node across several
+            # places, see metadata_wrapper
+            return self._to_propagate[original_node].deep_clone()
+        return updated_node
 
     def visit_Module(self, node):
         super().visit_Module(node)
@@ -36,6 +40,8 @@ class PropagationPass(BasePass):
 
 
 class CopyPropagationPass(PropagationPass):
+    # Removing code can leave a variable with a single assignment
+    enabled_by = ('inline', 'dead_code', 'copy_propagation', 'unused_vars')
     rhs_patterns = [m.Name(), m.Attribute(value=m.Name(), attr=m.Name())]
 
     def leave_Assign(self, original_node, updated_node):
@@ -9,12 +9,14 @@ from ..visitors import is_pure
 
 class DeadCodePass(BasePass):
     tracer_args = TracerArgs(trace_lines=True)
+    enabled_by = ('inline', 'dead_code', 'copy_propagation', 'unused_vars')
     exec_counts: ExecCounts
     block_execs: List[int]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.exec_counts = {}
+        self.partial_nodes = set()
 
     def visit_Module(self, node) -> None:
         super().visit_Module(node)
@@ -22,6 +24,10 @@ class DeadCodePass(BasePass):
         self.exec_counts = self.tracer.exec_counts()
         self.block_execs = [1]  # Module was executed once
 
+        # Code that a truncated trace may not have seen every execution of is
+        # left as is
+        self.partial_nodes = self.tracer.partial_nodes()
+
     def visit_IndentedBlock(self, node) -> None:
         super().visit_IndentedBlock(node)
         # Record the number of times the current IndentedBlock was executed
@@ -34,6 +40,9 @@ class DeadCodePass(BasePass):
         return final_node
 
     def leave_If(self, original_node, updated_node):
+        if original_node in self.partial_nodes:
+            return super().leave_If(original_node, updated_node)
+
         then_branch_count = self.exec_counts[original_node.body]
 
         # If then was always taken, just return then branch
@@ -55,6 +64,9 @@ class DeadCodePass(BasePass):
 
     def leave_Try(self, original_node, updated_node
                   ) -> Union[cst.BaseStatement, cst.RemovalSentinel]:
+        if original_node in self.partial_nodes:
+            return super().leave_Try(original_node, updated_node)
+
         for original_handler, updated_handler in zip(original_node.handlers,
                                                      updated_node.handlers):
             if self.exec_counts[original_handler.body] > 0:
@@ -83,7 +95,9 @@ class DeadCodePass(BasePass):
         if (isinstance(final_node, cst.BaseStatement) and not m.matches(
                 final_node,
                 m.SimpleStatementLine(body=[m.Expr(m.SimpleString())]))
-                and self.exec_counts[original_node] == 0):
+                and self.exec_counts[original_node] == 0
+                and original_node not in self.partial_nodes):
+            self.changed = True
             return cst.RemoveFromParent()
 
         return final_node
@@ -1,10 +1,9 @@
 import libcst as cst
 import libcst.matchers as m
-import inspect
 from typing import Optional, Union
 
 from .base_pass import BasePass
-from ..common import a2s, EvalException, get_function_locals, parse_statement, parse_expr
+from ..common import a2s, EvalException, get_function_locals, parse_function, parse_expr
 from .. import transforms
 from ..tracer import TracerArgs
 
@@ -12,6 +11,10 @@ from ..tracer import TracerArgs
 class InlinePass(BasePass):
     tracer_args = TracerArgs()
 
+    # Inlined bodies contain new calls, and propagated copies can turn
+    # indirect calls into direct ones
+    enabled_by = ('inline', 'copy_propagation')
+
     def _func_name(self, func):
         if m.matches(func, m.Name()):
             return func.value
@@ -29,7 +32,7 @@ class InlinePass(BasePass):
             if len(closure) > 0 and \
                not (len(closure) == 1
                     and next(iter(closure.keys())) == '__class__'):
-                fdef = parse_statement(inspect.getsource(func_obj))
+                _, fdef = parse_function(func_obj)
 
                 if len(fdef.decorators) == 0:
                     return False
@@ -78,7 +78,10 @@ class RecordToVarsPass(BasePass):
         super().visit_Module(node)
 
         finder = FindSafeObjsToConvert(self)
-        cst.MetadataWrapper(node).visit(finder)
+        wrapper = self.inliner.metadata_wrapper(node)
+        with self.timed('metadata'):
+            wrapper.resolve_many(finder.get_inherited_dependencies())
+        wrapper.visit(finder)
         safe_objs = finder.whitelist - finder.blacklist
 
         # We find all the objects that need to be inlined by going through
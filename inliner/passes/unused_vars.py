@@ -7,7 +7,8 @@ from ..visitors import is_pure
 
 
 class UnusedVarsPass(BasePass):
-    tracer_args = TracerArgs(trace_reads=True)
+    tracer_args = TracerArgs(trace_reads=True, aggregate_reads=True)
+    enabled_by = ('inline', 'dead_code', 'copy_propagation', 'unused_vars')
 
     def visit_Module(self, node):
         super().visit_Module(node)
@@ -0,0 +1,100 @@
+from typing import List, NamedTuple
+
+
+class PassProfile(NamedTuple):
+    """
+    Where the time of one run_pass went, in seconds.
+    """
+    pass_name: str
+    trace_time: float
+    metadata_time: float
+    transform_time: float
+    trim_time: float
+    nodes_visited: int
+    changed: bool
+
+    # Expressions evaluated by the pass, and how many of them reused a
+    # compiled code object
+    evals: int = 0
+    eval_hits: int = 0
+
+    @property
+    def total_time(self):
+        return (self.trace_time + self.metadata_time + self.transform_time +
+                self.trim_time)
+
+
+class Profiler:
+    """
+    Collects a PassProfile for every pass run by an Inliner.
+
+    Example:
+      i = Inliner(prog, profile=True)
+      i.optimize()
+      print(i.profiler.table())
+    """
+
+    COLUMNS = [('pass', 16), ('total', 9), ('trace', 9), ('metadata', 9),
+               ('transform', 10), ('trim', 9), ('nodes', 8), ('changed', 8),
+               ('evals', 7), ('eval hits', 10)]
+
+    def __init__(self):
+        self.records: List[PassProfile] = []
+
+    def record(self, profile):
+        self.records.append(profile)
+
+    def clear(self):
+        self.records = []
+
+    def totals(self):
+        """
+        Sums the records of each pass, in order of first run.
+        """
+        totals = {}
+        for r in self.records:
+            if r.pass_name not in totals:
+                totals[r.pass_name] = r
+            else:
+                prev = totals[r.pass_name]
+                totals[r.pass_name] = PassProfile(
+                    pass_name=r.pass_name,
+                    trace_time=prev.trace_time + r.trace_time,
+                    metadata_time=prev.metadata_time + r.metadata_time,
+                    transform_time=prev.transform_time + r.transform_time,
+                    trim_time=prev.trim_time + r.trim_time,
+                    nodes_visited=prev.nodes_visited + r.nodes_visited,
+                    changed=prev.changed or r.changed,
+                    evals=prev.evals + r.evals,
+                    eval_hits=prev.eval_hits + r.eval_hits)
+        return list(totals.values())
+
+    def _row(self, values, name_width):
+        widths = [name_width] + [width for _, width in self.COLUMNS[1:]]
+        return ' '.join(
+            str(v).rjust(width) if i > 0 else str(v).ljust(width)
+            for i, (v, width) in enumerate(zip(values, widths)))
+
+    def table(self, per_run=False):
+        """
+        Formats the records as a table, with one row per pass (or per run if
+        per_run=True), times in milliseconds and the hit rate of the
+        expression cache.
+        """
+        records = self.records if per_run else self.totals()
+        name_width = max([self.COLUMNS[0][1]] +
+                         [len(r.pass_name) for r in records])
+        lines = [self._row([name for name, _ in self.COLUMNS], name_width)]
+        for r in records:
+            lines.append(
+                self._row([
+                    r.pass_name, *[
+                        f'{1000 * t:.1f}'
+                        for t in [
+                            r.total_time, r.trace_time, r.metadata_time,
+                            r.transform_time, r.trim_time
+                        ]
+                    ], r.nodes_visited, r.changed, r.evals,
+                    f'{100 * r.eval_hits / r.evals:.0f}%' if r.evals else '-'
+                ], name_width))
+        return '\n'.join(lines)
@@ -1,5 +1,6 @@
 import importlib
 import inspect
+from collections import Counter
 
 import libcst as cst
 from libcst.metadata import PositionProvider
@@ -21,6 +22,13 @@ class InlineTarget:
     def should_inline(self, code, obj):
         raise NotImplementedError
 
+    def depends_on_code(self, obj):
+        """
+        Whether should_inline for this object depends on the expression that
+        evaluated to it, rather than the object alone.
+        """
+        return False
+
 
 class ModuleTarget(InlineTarget):
     """
@@ -62,6 +70,9 @@ class CursorTarget(InlineTarget):
     def to_string(self):
         return f'CursorTarget({self.target})'
 
+    def depends_on_code(self, obj):
+        return True
+
     def should_inline(self, code, obj):
         pass_ = ctx_pass.get()
         pos = pass_.get_metadata(PositionProvider, code, None)
@@ -126,6 +137,109 @@ class ClassTarget(InlineTarget):
 
         return constructor or bound_method or unbound_method or dunder_call
 
+    def depends_on_code(self, obj):
+        # Unbound methods are checked against the class they're accessed on
+        return inspect.isfunction(obj)
+
+
+class TargetIndex:
+    """
+    The targets of an Inliner, indexed so an object is checked against all
+    of them at once instead of one target at a time.
+
+    Module targets are kept in a trie of dotted module names, and function
+    targets in a set. Other targets (classes, cursors, custom targets) are
+    still checked one by one, since they match subclasses or depend on the
+    expression.
+    """
+
+    # Key of a trie node marking the number of targets for that module
+    _COUNT = None
+
+    def __init__(self, targets=()):
+        self.module_trie = {}
+        self.functions = Counter()
+        self.others = []
+        for target in targets:
+            self.add(target)
+
+    def add(self, target):
+        if type(target) is ModuleTarget:
+            node = self.module_trie
+            for part in target.target.__name__.split('.'):
+                node = node.setdefault(part, {})
+            node[self._COUNT] = node.get(self._COUNT, 0) + 1
+        elif type(target) is FunctionTarget:
+            self.functions[target.target] += 1
+        else:
+            self.others.append(target)
+
+    def remove(self, target):
+        if type(target) is ModuleTarget:
+            path = [self.module_trie]
+            for part in target.target.__name__.split('.'):
+                path.append(path[-1][part])
+
+            path[-1][self._COUNT] -= 1
+            if path[-1][self._COUNT] == 0:
+                del path[-1][self._COUNT]
+
+            # Prune nodes without targets below them
+            parts = target.target.__name__.split('.')
+            for parent, node, part in reversed(
+                    list(zip(path[:-1], path[1:], parts))):
+                if node:
+                    break
+                del parent[part]
+        elif type(target) is FunctionTarget:
+            self.functions[target.target] -= 1
+            if self.functions[target.target] == 0:
+                del self.functions[target.target]
+        else:
+            self.others.remove(target)
+
+    def _matches_module(self, obj):
+        module = inspect.getmodule(obj)
+        if module is None:
+            return False
+
+        # Check if object is defined in a target module or a submodule of one
+        node = self.module_trie
+        for part in module.__name__.split('.'):
+            node = node.get(part)
+            if node is None:
+                return False
+            if self._COUNT in node:
+                return True
+        return False
+
+    def _matches_function(self, obj):
+        if inspect.ismethod(obj):
+            obj = obj.__func__
+        elif not inspect.isfunction(obj):
+            return False
+        return obj in self.functions
+
+    def should_inline(self, code, obj):
+        """
+        Whether any target that doesn't depend on the expression matches.
+        """
+        if self.module_trie and self._matches_module(obj):
+            return True
+        if self.functions and self._matches_function(obj):
+            return True
+        return any(
+            target.should_inline(code, obj) for target in self.others
+            if not target.depends_on_code(obj))
+
+    def code_dependent(self, obj):
+        """
+        Targets whose decision for obj depends on the expression.
+        """
+        return [
+            target for target in self.others if target.depends_on_code(obj)
+        ]
+
 
 def make_target(target):
     if isinstance(target, InlineTarget):
@@ -1,7 +1,18 @@
+import builtins
 import dis
+import hashlib
+import io
+import linecache
+import marshal
+import os
+import pickle
 import sys
-from collections import defaultdict
-from tempfile import NamedTemporaryFile
+import time
+import traceback
+import types
+from array import array
+from bisect import bisect_right, insort
+from collections import OrderedDict, defaultdict
 from typing import Any, Dict, NamedTuple, Optional
 
 import libcst as cst
@@ -15,26 +26,225 @@ ExecCounts = Dict[cst.CSTNode, int]
 Globals = Dict[str, Any]
 
 
+def register_source(code):
+    """
+    Makes source code visible to inspect.getsource without writing it to disk.
+
+    The code is stored in linecache under a synthetic filename derived from
+    its contents, so tracing the same program again reuses the entry. Past
+    MAX_REGISTERED_SOURCES, the least recently registered sources are removed
+    from linecache, so whatever still needs a source (a cached trace, an
+    incremental checkpoint) keeps its text and registers it again before use.
+    """
+    digest = hashlib.md5(code.encode('utf-8')).hexdigest()
+    fname = f'<{TRACER_FILE_PREFIX}-{digest}>'
+
+    # An mtime of None tells linecache.checkcache not to look for the file
+    linecache.cache[fname] = (len(code), None, code.splitlines(True), fname)
+
+    _REGISTERED_SOURCES[fname] = None
+    _REGISTERED_SOURCES.move_to_end(fname)
+    while len(_REGISTERED_SOURCES) > MAX_REGISTERED_SOURCES:
+        old, _ = _REGISTERED_SOURCES.popitem(last=False)
+        linecache.cache.pop(old, None)
+    return fname
+
+
+# Registered sources, least recently registered first
+MAX_REGISTERED_SOURCES = 64
+_REGISTERED_SOURCES = OrderedDict()
+
+
+def is_tracer_source(fname):
+    return fname.startswith(f'<{TRACER_FILE_PREFIX}-')
+
+
 def compile_and_exec(code, globls):
-    with NamedTemporaryFile(delete=False, prefix=TRACER_FILE_PREFIX) as f:
-        f.write(code.encode('utf-8'))
-        f.flush()
-        exec(compile(code, f.name, 'exec'), globls, globls)
+    fname = register_source(code)
+    exec(compile(code, fname, 'exec'), globls, globls)
+
+
+# Instructions are reported as (is_write, name) events. Python 3.13+ fuses
+# some pairs of loads and stores into a single instruction with a tuple argval.
+WRITE_INSTRS = set(['STORE_NAME', 'STORE_FAST', 'STORE_GLOBAL'])
+READ_INSTRS = set([
+    'LOAD_NAME', 'LOAD_FAST', 'LOAD_GLOBAL', 'LOAD_FAST_CHECK',
+    'LOAD_FAST_BORROW'
+])
+FUSED_IO_INSTRS = {
+    'LOAD_FAST_LOAD_FAST': (False, False),
+    'LOAD_FAST_BORROW_LOAD_FAST_BORROW': (False, False),
+    'STORE_FAST_LOAD_FAST': (True, False),
+    'STORE_FAST_STORE_FAST': (True, True),
+}
 
 
 # https://blog.hakril.net/articles/2-understanding-python-execution-tracer.html
-class FrameAnalyzer:
+class CodeAnalyzer:
+    """
+    Disassembles a code object into a lookup table from instruction offset
+    to the loads and stores it performs.
+
+    Analyzers are cached per code object, so they are shared by every frame
+    executing the same code and don't keep frames alive.
+    """
+    def __init__(self, code):
+        self.in_closure = code.co_name != '<module>'
+
+        # Tables are indexed by offset // 2, the size of a code unit.
+        # io_events holds None for instructions that aren't loads or stores,
+        # and lines holds -1 where an instruction has no line number.
+        num_units = len(code.co_code) // 2
+        self.io_events = [None] * num_units
+        self.lines = array('i', [-1]) * num_units
+
+        for instr in dis.get_instructions(code):
+            unit = instr.offset // 2
+            positions = getattr(instr, 'positions', None)
+            if positions is not None and positions.lineno is not None:
+                self.lines[unit] = positions.lineno
+
+            if instr.opname in WRITE_INSTRS:
+                self.io_events[unit] = ((True, instr.argval), )
+            elif instr.opname in READ_INSTRS:
+                self.io_events[unit] = ((False, instr.argval), )
+            elif instr.opname in FUSED_IO_INSTRS:
+                self.io_events[unit] = tuple(
+                    zip(FUSED_IO_INSTRS[instr.opname], instr.argval))
+
+
+class TracerBackend:
+    """
+    A mechanism for observing the execution of a traced program.
+
+    Backends report executed lines and load/store instructions back to the
+    Tracer through Tracer._record_line and Tracer._record_io.
+    """
+    def start(self, tracer):
+        raise NotImplementedError
+
+    def add_code(self, code):
+        pass
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class SettraceBackend(TracerBackend):
     """
-    Disassembles a runtime stack frame.
+    Traces with sys.settrace. Available on every interpreter, but every call
+    in the process (including library code) goes through the trace function.
     """
-    def __init__(self, frame):
-        self.frame = frame
-        self.code = frame.f_code
-        self.bytecode = dis.Bytecode(self.code)
-        self._instr_lookup = {i.offset: i for i in self.bytecode}
+    def start(self, tracer):
+        self.tracer = tracer
+        sys.settrace(self._trace_fn)
+
+    def stop(self):
+        sys.settrace(None)
 
-    def current_instr(self):
-        return self._instr_lookup[self.frame.f_lasti]
+    def _trace_fn(self, frame, event, arg):
+        tracer = self.tracer
+        if frame.f_code.co_filename not in tracer._fnames:
+            frame.f_trace = None
+            return
+
+        frame.f_trace_opcodes = tracer.trace_reads
+        frame.f_trace_lines = tracer.observe_lines
+
+        if event == 'opcode':
+            analyzer = tracer.code_analyzer(frame.f_code)
+            io_events = analyzer.io_events[frame.f_lasti // 2]
+            if io_events is not None:
+                tracer._record_io(io_events, frame.f_lineno,
+                                  analyzer.in_closure)
+
+        elif event == 'line':
+            tracer._record_line(frame.f_lineno)
+
+        return self._trace_fn
+
+
+class MonitoringBackend(TracerBackend):
+    """
+    Traces with sys.monitoring (PEP 669, Python 3.12+). Events are only
+    enabled on the code objects compiled from the traced program, so library
+    code called by the program runs at full speed.
+    """
+
+    TOOL_NAME = 'inliner'
+
+    def __init__(self):
+        self._codes = []
+
+    def start(self, tracer):
+        mon = sys.monitoring
+        self.tracer = tracer
+
+        self.tool_id = next(
+            (i for i in range(6) if mon.get_tool(i) is None), None)
+        if self.tool_id is None:
+            raise RuntimeError('No free sys.monitoring tool id for tracer')
+        mon.use_tool_id(self.tool_id, self.TOOL_NAME)
+
+        self.events = 0
+        if tracer.observe_lines:
+            self.events |= mon.events.LINE | mon.events.JUMP
+            mon.register_callback(self.tool_id, mon.events.LINE, self._on_line)
+            mon.register_callback(self.tool_id, mon.events.JUMP, self._on_jump)
+        if tracer.trace_reads:
+            self.events |= mon.events.INSTRUCTION
+            mon.register_callback(self.tool_id, mon.events.INSTRUCTION,
+                                  self._on_instruction)
+
+    def add_code(self, code):
+        # Functions, classes and comprehensions defined in the program are
+        # compiled into nested code objects stored as constants
+        sys.monitoring.set_local_events(self.tool_id, code, self.events)
+        self._codes.append(code)
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                self.add_code(const)
+
+    def stop(self):
+        mon = sys.monitoring
+        for code in self._codes:
+            mon.set_local_events(self.tool_id, code, 0)
+        mon.register_callback(self.tool_id, mon.events.LINE, None)
+        mon.register_callback(self.tool_id, mon.events.JUMP, None)
+        mon.register_callback(self.tool_id, mon.events.INSTRUCTION, None)
+        mon.free_tool_id(self.tool_id)
+
+    def _on_line(self, code, line):
+        self.tracer._record_line(line)
+
+    def _on_jump(self, code, offset, destination):
+        # sys.settrace reports a line event when a loop jumps backwards to
+        # the start of the same line (e.g. a single-line comprehension), but
+        # sys.monitoring only fires LINE when the line number changes
+        if destination > offset:
+            return sys.monitoring.DISABLE
+
+        lines = self.tracer.code_analyzer(code).lines
+        line = lines[offset // 2]
+        if line != -1 and line == lines[destination // 2]:
+            self.tracer._record_line(line)
+
+    def _on_instruction(self, code, offset):
+        analyzer = self.tracer.code_analyzer(code)
+        io_events = analyzer.io_events[offset // 2]
+        if io_events is None:
+            # Only loads and stores are interesting, so stop reporting
+            # other instructions at this location
+            return sys.monitoring.DISABLE
+
+        self.tracer._record_io(io_events, analyzer.lines[offset // 2],
+                               analyzer.in_closure)
+
+
+def default_backend():
+    if hasattr(sys, 'monitoring'):
+        return MonitoringBackend()
+    return SettraceBackend()
 
 
 class InsertDummyTransformer(cst.CSTTransformer):
@@ -103,6 +313,46 @@ class ExecCountsVisitor(cst.CSTVisitor):
         return super().on_visit(node)
 
 
+class PartialNodesVisitor(cst.CSTVisitor):
+    """
+    Finds the nodes whose executions weren't all observed by a truncated
+    trace: everything in or after the top-level statement that was cut off,
+    and the bodies of functions, which may still be called after it.
+    """
+    METADATA_DEPENDENCIES = (PositionProvider, )
+
+    def __init__(self, cutoff_line):
+        super().__init__()
+        self.cutoff_line = cutoff_line
+        self.in_function = 0
+        self.partial_nodes = set()
+
+    def visit_Module(self, node):
+        for stmt in node.body:
+            pos = self.get_metadata(PositionProvider, stmt)
+            if pos.start.line <= self.cutoff_line <= pos.end.line:
+                self.cutoff_line = pos.start.line
+                break
+
+    def visit_FunctionDef(self, node):
+        self.in_function += 1
+
+    def leave_FunctionDef(self, node):
+        self.in_function -= 1
+
+    def visit_Lambda(self, node):
+        self.in_function += 1
+
+    def leave_Lambda(self, node):
+        self.in_function -= 1
+
+    def on_visit(self, node) -> bool:
+        pos = self.get_metadata(PositionProvider, node)
+        if self.in_function > 0 or pos.end.line >= self.cutoff_line:
+            self.partial_nodes.add(node)
+        return super().on_visit(node)
+
+
 class UnusedVarsVisitor(cst.CSTVisitor):
     METADATA_DEPENDENCIES = (PositionProvider, )
 
@@ -114,24 +364,20 @@ class UnusedVarsVisitor(cst.CSTVisitor):
         self.get_unused_lines()
 
     def get_unused_lines(self):
-        for k, writes in self.tracer.writes.items():
-            reads = self.tracer.reads[k]
+        summary = self.tracer.io_summary if self.tracer.aggregate_reads \
+            else IOSummary.from_events(self.tracer.writes, self.tracer.reads)
 
-            for i, cur_write in enumerate(writes):
-                next_possible_writes = [
-                    next_write.line for next_write in writes[i + 1:]
-                    if next_write.line > cur_write.line
-                ]
-                next_write_line = min(next_possible_writes, default=sys.maxsize)
+        # A write is unused if no read happens on a line after it and up to
+        # the next line that overwrites the variable
+        for k, next_writes in summary.next_writes.items():
+            if k in summary.closure_reads:
+                continue
 
-                unused = True
-                for read in reads:
-                    if (cur_write.line < read.line and
-                            read.line <= next_write_line) or read.in_closure:
-                        unused = False
-
-                if unused:
-                    self.unused_lines.add(cur_write.line)
+            reads = sorted(summary.read_lines[k])
+            for write_line, next_write_line in next_writes.items():
+                i = bisect_right(reads, write_line)
+                if i == len(reads) or reads[i] > next_write_line:
+                    self.unused_lines.add(write_line)
 
     def get_is_unused(self, node):
         pos = self.get_metadata(PositionProvider, node)
@@ -148,69 +394,756 @@ class TracerArgs(NamedTuple):
     trace_reads: bool = False
     debug: bool = False
 
+    # Only summarize loads and stores into Tracer.io_summary rather than
+    # keeping every event in Tracer.reads and Tracer.writes
+    aggregate_reads: bool = False
+
+    # Budgets after which the program is cut off, see Tracer.truncated
+    max_seconds: Optional[float] = None
+    max_lines: Optional[int] = None
+
+    def union(self, other):
+        """
+        Arguments for a trace that collects everything both traces would,
+        within the tighter of their budgets.
+        """
+        args = TracerArgs(*[a or b for a, b in zip(self, other)])
+
+        # The summary is enough only if every trace of reads asks for it
+        aggregate_reads = all(
+            a.aggregate_reads for a in (self, other) if a.trace_reads)
+
+        budgets = {
+            field: min((getattr(a, field) for a in (self, other)
+                        if getattr(a, field) is not None),
+                       default=None)
+            for field in ['max_seconds', 'max_lines']
+        }
+        return args._replace(aggregate_reads=args.trace_reads
+                             and aggregate_reads,
+                             **budgets)
+
+
+class TraceBudgetExceeded(BaseException):
+    """
+    Raised into a traced program when it runs over the budgets of its
+    TracerArgs. Not an Exception, so the program can't catch it by accident.
+    """
+    pass
+
 
 class IOEvent(NamedTuple):
     line: int
     in_closure: bool
 
 
+class IOEventStore:
+    """
+    Columnar storage for the load or store events of a trace.
+
+    Variable names are interned to integer ids, and each event is a row
+    across compact arrays of name ids, lines and closure flags instead of an
+    IOEvent object. Querying a name returns its events as a list of IOEvents,
+    like a defaultdict(list) would.
+    """
+    def __init__(self):
+        self._name_ids = {}
+        self._names = []
+        self._name_col = array('i')
+        self._line_col = array('i')
+        self._closure_col = array('b')
+
+        # Rows of each name id, built on the first query after an append
+        self._index = None
+
+    def append(self, name, line, in_closure):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+
+        self._name_col.append(name_id)
+        self._line_col.append(line)
+        self._closure_col.append(in_closure)
+        self._index = None
+
+    def _rows(self, name):
+        if self._index is None:
+            self._index = defaultdict(lambda: array('i'))
+            for row, name_id in enumerate(self._name_col):
+                self._index[name_id].append(row)
+
+        name_id = self._name_ids.get(name)
+        if name_id is None or name_id not in self._index:
+            return array('i')
+        return self._index[name_id]
+
+    def lines(self, name):
+        return array('i', [self._line_col[row] for row in self._rows(name)])
+
+    def any_in_closure(self, name):
+        return any(self._closure_col[row] for row in self._rows(name))
+
+    def __getitem__(self, name):
+        return [
+            IOEvent(line=self._line_col[row],
+                    in_closure=bool(self._closure_col[row]))
+            for row in self._rows(name)
+        ]
+
+    def __contains__(self, name):
+        return name in self._name_ids
+
+    def __len__(self):
+        return len(self._name_col)
+
+    def keys(self):
+        return list(self._names)
+
+    def items(self):
+        return [(name, self[name]) for name in self._names]
+
+    def __getstate__(self):
+        # The index is rebuilt on demand, and its default factory can't be
+        # pickled
+        return {**self.__dict__, '_index': None}
+
+    def prefix(self, n):
+        """
+        Copies the first n events into a new store.
+        """
+        store = IOEventStore()
+        store._name_col = self._name_col[:n]
+        store._line_col = self._line_col[:n]
+        store._closure_col = self._closure_col[:n]
+
+        # Ids are assigned in order of first use, so the names used by the
+        # first n events are exactly the ones with the lowest ids
+        store._names = self._names[:max(store._name_col, default=-1) + 1]
+        store._name_ids = {name: i for i, name in enumerate(store._names)}
+        return store
+
+    def nbytes(self):
+        return sum(col.itemsize * len(col)
+                   for col in (self._name_col, self._line_col,
+                               self._closure_col))
+
+
+class IOSummary:
+    """
+    Summary of the loads and stores of a trace that is bounded by the size of
+    the program rather than the number of executed instructions.
+
+    For each variable, maps every line that wrote to it to the smallest line
+    greater than it that wrote to the variable at any later point in time
+    (sys.maxsize if none). Reads are kept as the set of distinct lines,
+    along with the variables that were read inside a closure.
+    """
+    def __init__(self):
+        self.next_writes = defaultdict(dict)
+        self.read_lines = defaultdict(set)
+        self.closure_reads = set()
+
+    @classmethod
+    def from_events(cls, writes, reads):
+        """
+        Summarizes the events of a full trace in one backwards sweep over the
+        writes of each variable.
+        """
+        summary = cls()
+        for name in writes.keys():
+            next_writes = summary.next_writes[name]
+
+            # Sorted distinct lines of the writes after the current one. The
+            # earliest write of a line is seen last, and has the smallest
+            # later line of all the writes of that line.
+            later_lines = []
+            for line in reversed(writes.lines(name)):
+                i = bisect_right(later_lines, line)
+                next_writes[line] = later_lines[i] if i < len(later_lines) \
+                    else sys.maxsize
+                if i == 0 or later_lines[i - 1] != line:
+                    insort(later_lines, line)
+
+        for name in reads.keys():
+            summary.read_lines[name] = set(reads.lines(name))
+            if reads.any_in_closure(name):
+                summary.closure_reads.add(name)
+
+        return summary
+
+    def add_write(self, name, line):
+        next_writes = self.next_writes[name]
+        for prev_line, next_line in next_writes.items():
+            if prev_line < line < next_line:
+                next_writes[prev_line] = line
+
+        if line not in next_writes:
+            next_writes[line] = sys.maxsize
+
+    def add_read(self, name, line, in_closure):
+        self.read_lines[name].add(line)
+        if in_closure:
+            self.closure_reads.add(name)
+
+
+# Builtins that read or write the globals of their caller by name
+DYNAMIC_SCOPE_NAMES = {'globals', 'locals', 'vars', 'eval', 'exec'}
+
+# Builtins that don't change their arguments
+PURE_CALLEES = {
+    abs, bool, dict, enumerate, float, frozenset, hash, id, int, isinstance,
+    len, list, max, min, print, range, repr, set, sorted, str, sum, tuple,
+    type, zip
+}
+
+IMMUTABLE_TYPES = (type(None), type(Ellipsis), bool, int, float, complex, str,
+                   bytes, range)
+
+
+def _base_name(node):
+    while isinstance(node, (cst.Attribute, cst.Subscript, cst.Call)):
+        node = node.func if isinstance(node, cst.Call) else node.value
+    return node.value if isinstance(node, cst.Name) else None
+
+
+def _defined_by_program(value):
+    if isinstance(value, types.FunctionType):
+        return is_tracer_source(value.__code__.co_filename)
+    if isinstance(value, type):
+        return any(
+            _defined_by_program(getattr(attr, '__func__', attr))
+            for attr in vars(value).values())
+    return False
+
+
+def _needs_checkpoint(value):
+    """
+    Whether a checkpoint has to keep a value from being changed in place.
+
+    Modules and functions are shared by every trace of a program anyway, so
+    only immutable values and the ones the program defines are safe.
+    """
+    if isinstance(value, IMMUTABLE_TYPES + (types.ModuleType, )):
+        return False
+    if isinstance(value, (tuple, frozenset)):
+        return any(_needs_checkpoint(v) for v in value)
+    if isinstance(value, (types.FunctionType, type)):
+        return _defined_by_program(value)
+    return not isinstance(value, types.BuiltinFunctionType)
+
+
+def _fingerprint(globls, base_globls):
+    """
+    Hash of the contents of the containers and program-defined objects
+    reachable from the globals that aren't in base_globls.
+
+    Values can be changed in place through names that StatementEffects
+    doesn't see (e.g. a loop variable or another alias of a nested list), so
+    a checkpoint is only restored if its fingerprint didn't change.
+    """
+    parts = []
+    seen = set()
+    stack = [
+        value for name, value in globls.items()
+        if value is not base_globls.get(name) and name != '__builtins__'
+    ]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+
+        if isinstance(value, dict):
+            items = [*value.keys(), *value.values()]
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            items = list(value)
+        elif isinstance(getattr(value, '__dict__', None), dict) \
+                and not isinstance(value, (type, types.ModuleType,
+                                           types.FunctionType)) \
+                and not _importable(type(value)):
+            items = [*vars(value).keys(), *vars(value).values()]
+        else:
+            continue
+
+        if set(map(type, items)).issubset(IMMUTABLE_TYPES):
+            parts.append((id(value), tuple(items)))
+            continue
+        contents = []
+        for item in items:
+            if type(item) in IMMUTABLE_TYPES:
+                contents.append(item)
+            else:
+                contents.append((id(item), ))
+                stack.append(item)
+        parts.append((id(value), tuple(contents)))
+    return hash(tuple(parts))
+
+
+class StatementEffects(cst.CSTVisitor):
+    """
+    Approximates the global names whose values a top-level statement may
+    change in place.
+
+    Stores to and deletes of attributes or items of a name, augmented
+    assignments and method calls on a name (e.g. df.dropna(inplace=True))
+    count as changes. Changes in the body of a function or class are latent:
+    they happen whenever it gets called after its definition. Names passed to
+    a call count as changed, unless the callee is a builtin in PURE_CALLEES.
+    Using globals(), eval, etc. may change anything, except for testing
+    whether a name is in globals().
+    """
+    def __init__(self):
+        super().__init__()
+        self.changed = set()
+        self.latent = set()
+        self.passed = defaultdict(set)
+        self.dynamic = False
+        self.depth = 0
+
+    def _change(self, name):
+        if name is not None:
+            (self.latent if self.depth > 0 else self.changed).add(name)
+
+    def _store(self, target):
+        if isinstance(target, (cst.Tuple, cst.List)):
+            for elem in target.elements:
+                self._store(elem.value)
+        elif isinstance(target, (cst.Attribute, cst.Subscript)):
+            self._change(_base_name(target.value))
+
+    def visit_FunctionDef(self, node):
+        self.depth += 1
+
+    def leave_FunctionDef(self, node):
+        self.depth -= 1
+
+    def visit_ClassDef(self, node):
+        self.depth += 1
+
+    def leave_ClassDef(self, node):
+        self.depth -= 1
+
+    def visit_Lambda(self, node):
+        self.depth += 1
+
+    def leave_Lambda(self, node):
+        self.depth -= 1
+
+    def visit_Assign(self, node):
+        for target in node.targets:
+            self._store(target.target)
+
+    def visit_AnnAssign(self, node):
+        self._store(node.target)
+
+    def visit_AugAssign(self, node):
+        self._change(_base_name(node.target))
+
+    def visit_Del(self, node):
+        self._store(node.target)
+
+    def visit_For(self, node):
+        self._store(node.target)
+
+    def visit_CompFor(self, node):
+        self._store(node.target)
+
+    def visit_WithItem(self, node):
+        if node.asname is not None:
+            self._store(node.asname.name)
+
+    def visit_Call(self, node):
+        if isinstance(node.func, cst.Attribute):
+            self._change(_base_name(node.func.value))
+
+        args = {
+            arg.value.value
+            for arg in node.args if isinstance(arg.value, cst.Name)
+        }
+        if isinstance(node.func, cst.Name) and self.depth == 0:
+            self.passed[node.func.value].update(args)
+        else:
+            for name in args:
+                self._change(name)
+
+    def visit_ComparisonTarget(self, node):
+        # e.g. "f_ret" not in globals(), as inserted for early returns, only
+        # reads the globals
+        comparator = node.comparator
+        if isinstance(node.operator, (cst.In, cst.NotIn)) \
+                and isinstance(comparator, cst.Call) \
+                and isinstance(comparator.func, cst.Name) \
+                and comparator.func.value in ('globals', 'locals') \
+                and not comparator.args:
+            return False
+
+    def visit_Name(self, node):
+        if node.value in DYNAMIC_SCOPE_NAMES:
+            self.dynamic = True
+
+    def changed_names(self, globls, latent):
+        """
+        Names changed by executing the statement, given the latent changes of
+        the functions defined so far.
+        """
+        names = self.changed | latent
+        for func, args in self.passed.items():
+            callee = globls[func] if func in globls else \
+                getattr(builtins, func, None)
+            try:
+                pure = callee in PURE_CALLEES
+            except TypeError:
+                pure = False
+            if not pure:
+                names |= args
+        return names
+
+
+class TraceCheckpoint:
+    """
+    The state of an incremental trace after executing a top-level statement.
+    """
+    def __init__(self, key, code, program, effects, globls, fingerprint,
+                 lines, num_reads, num_writes, protected):
+        # (first line, source) of the statement
+        self.key = key
+        self.code = code
+        # Source of the program the statement was compiled from
+        self.program = program
+        self.effects = effects
+        # Shallow copy of the globals after the statement
+        self.globls = globls
+        # _fingerprint of the globals after the statement
+        self.fingerprint = fingerprint
+        # Line counts of the statement alone
+        self.lines = lines
+        self.num_reads = num_reads
+        self.num_writes = num_writes
+        # Ids of the values in globls that must not be changed in place
+        self.protected = protected
+        self.valid = True
+
+
+class IncrementalTrace:
+    """
+    Checkpoints of the last trace of a program, one after each top-level
+    statement.
+
+    Tracing a new version of the program with Tracer.trace(incremental=...)
+    restores the checkpoint at the end of the longest prefix of unchanged
+    statements, so only the statements after it are executed again.
+
+    A checkpoint is a shallow copy of the globals, so it is invalidated when a
+    later statement may have changed one of its values in place (see
+    StatementEffects), or when the containers and program-defined objects
+    reachable from its globals were changed by any other reference (see
+    _fingerprint). State outside of the program's globals, like files or
+    the attributes of modules, isn't restored.
+    """
+    def __init__(self, base_globls=None):
+        self.base_globls = base_globls if base_globls is not None else {}
+        self.checkpoints = []
+        self.reads = IOEventStore()
+        self.writes = IOEventStore()
+        self.stats = {'executed': 0, 'restored': 0}
+
+        # Globals of every trace, so functions defined by a restored statement
+        # see the globals of the trace that calls them
+        self.globls = {}
+
+    def resume_point(self, keys):
+        """
+        Number of statements at the start of a program that can be restored.
+        """
+        unchanged = 0
+        for checkpoint, key in zip(self.checkpoints, keys):
+            if checkpoint.key != key:
+                break
+            unchanged += 1
+
+        for i in reversed(range(unchanged)):
+            checkpoint = self.checkpoints[i]
+            if checkpoint.valid and checkpoint.fingerprint == _fingerprint(
+                    checkpoint.globls, self.base_globls):
+                return i + 1
+        return 0
+
+    def reset(self):
+        self.checkpoints = []
+
+
+class PackedFunction(NamedTuple):
+    code: bytes
+    name: str
+    qualname: str
+    defaults: Any
+    kwdefaults: Any
+    # Values of the free variables, except for __class__ (e.g. for super())
+    # which refers to the class the function is defined in
+    closure: tuple
+
+
+class PackedClass(NamedTuple):
+    name: str
+    qualname: str
+    bases: tuple
+    namespace: dict
+
+
+class PackedWrapper(NamedTuple):
+    # e.g. staticmethod, with the arguments that create it
+    kind: type
+    args: tuple
+
+
+def _importable(value):
+    module = sys.modules.get(getattr(value, '__module__', None))
+    obj = module
+    for attr in getattr(value, '__qualname__', '<locals>').split('.'):
+        obj = getattr(obj, attr, None)
+    return obj is value
+
+
+def _is_program_definition(value, module):
+    """
+    Whether a value is a function or class defined by the program executed
+    as the given module, which can't be pickled by reference.
+    """
+    if isinstance(value, types.FunctionType):
+        return _defined_by_program(value)
+    if isinstance(value, type):
+        return _defined_by_program(value) or (value.__module__ == module
+                                              and not _importable(value))
+    return False
+
+
+def _unpack(value, globls, cell=None):
+    """
+    Recreates a definition packed by ProgramPickler, bound to globls.
+    """
+    if isinstance(value, PackedFunction):
+        code = marshal.loads(value.code)
+        closure = tuple(
+            cell if var == '__class__' else types.CellType(
+                _unpack(contents, globls))
+            for var, contents in zip(code.co_freevars, value.closure))
+        func = types.FunctionType(code, globls, value.name, value.defaults,
+                                  closure or None)
+        func.__qualname__ = value.qualname
+        func.__kwdefaults__ = value.kwdefaults
+        return func
+
+    if isinstance(value, PackedWrapper):
+        return value.kind(*[_unpack(arg, globls, cell) for arg in value.args])
+
+    if isinstance(value, PackedClass):
+        cell = types.CellType()
+        cls = type(value.name, value.bases, {
+            k: _unpack(v, globls, cell)
+            for k, v in value.namespace.items()
+        })
+        cls.__qualname__ = value.qualname
+        cell.cell_contents = cls
+        return cls
+
+    return value
+
+
+class ProgramPickler(pickle.Pickler):
+    """
+    Pickles the functions and classes defined by a program as a description
+    of their code (see _unpack), or as a reference to their global name if
+    they are the value of a global.
+    """
+    def __init__(self, file, module, names):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.module = module
+        self.names = names
+
+    @staticmethod
+    def global_names(globls, module):
+        """
+        Names of the globals that are definitions of the program, by id.
+        """
+        names = {}
+        for name, value in globls.items():
+            if _is_program_definition(value, module):
+                names.setdefault(id(value), name)
+        return names
+
+    def dump_global(self, name, value):
+        self.dump(self.pack(value, name))
+
+    def persistent_id(self, obj):
+        if id(obj) in self.names:
+            return self.names[id(obj)]
+        if _is_program_definition(obj, self.module):
+            return ('packed', self.pack(obj))
+        return None
+
+    def pack(self, value, name=None):
+        if id(value) in self.names and self.names[id(value)] != name:
+            return value
+
+        if isinstance(value, (staticmethod, classmethod)):
+            return PackedWrapper(type(value), (self.pack(value.__func__), ))
+
+        if isinstance(value, property):
+            return PackedWrapper(
+                property,
+                tuple(self.pack(f)
+                      for f in (value.fget, value.fset, value.fdel)) +
+                (value.__doc__, ))
+
+        if not _is_program_definition(value, self.module):
+            return value
+
+        if isinstance(value, types.FunctionType):
+            closure = tuple(
+                None if var == '__class__' else self.pack(cell.cell_contents)
+                for var, cell in zip(value.__code__.co_freevars,
+                                     value.__closure__ or ()))
+            return PackedFunction(marshal.dumps(value.__code__),
+                                  value.__name__, value.__qualname__,
+                                  value.__defaults__, value.__kwdefaults__,
+                                  closure)
+
+        if type(value) is not type:
+            raise TypeError(f"{value.__qualname__} has a metaclass")
+        return PackedClass(
+            value.__name__, value.__qualname__, value.__bases__, {
+                k: self.pack(v)
+                for k, v in vars(value).items()
+                if k not in ('__dict__', '__weakref__')
+            })
+
+
+class ProgramUnpickler(pickle.Unpickler):
+    def __init__(self, file, globls, load_global):
+        super().__init__(file)
+        self.globls = globls
+        self.load_global = load_global
+
+    def persistent_load(self, pid):
+        if isinstance(pid, tuple):
+            return _unpack(pid[1], self.globls)
+        return self.load_global(pid)
+
+
 class Tracer:
     """
     Executes a program and collects information about loads, writes, and executed lines.
     """
 
-    write_instrs = set(['STORE_NAME', 'STORE_FAST', 'STORE_GLOBAL'])
-    read_instrs = set(['LOAD_NAME', 'LOAD_FAST', 'LOAD_GLOBAL'])
     globls: Globals
 
     def __init__(self,
                  module,
                  globls: Optional[Globals] = None,
                  args: Optional[TracerArgs] = None,
-                 cache: bool = True):
+                 cache: bool = True,
+                 backend: Optional[TracerBackend] = None):
         if args is None:
             args = TracerArgs()
         self.module = module
         transformer = InsertDummyTransformer()
         self.transformed_module = self.module.visit(transformer)
         self.node_map = transformer.node_map
-        self.reads = defaultdict(list)
-        self.writes = defaultdict(list)
+        self.reads = IOEventStore()
+        self.writes = IOEventStore()
         self.execed_lines = defaultdict(int)
         self.trace_lines = args.trace_lines
         self.trace_reads = args.trace_reads
-        self._frame_analyzers = {}
+        self.aggregate_reads = args.aggregate_reads
+        self.io_summary = IOSummary()
+
+        # Line events are needed to count the line budget, and to check the
+        # time budget while the program runs
+        self.max_seconds = args.max_seconds
+        self.max_lines = args.max_lines
+        self.has_budget = args.max_seconds is not None or \
+            args.max_lines is not None
+        self.observe_lines = args.trace_lines or args.trace_reads or \
+            self.has_budget
+        self.num_lines = 0
+
+        # Whether the program was cut off by a budget, and the line of the
+        # top-level statement that was executing then
+        self.truncated = False
+        self.cutoff_line = None
+        self.backend = backend if backend is not None else default_backend()
+        self._code_analyzers = {}
         self.globls = globls.copy() if globls is not None else {}
 
-    def _trace_fn(self, frame, event, arg):
-        if frame.f_code.co_filename != self._fname:
-            frame.f_trace = None
-            return
+        # Sources of the programs that defined functions in globls
+        self.sources = []
 
-        frame.f_trace_opcodes = self.trace_reads
-        frame.f_trace_lines = self.trace_lines or self.trace_reads
+        # Globals of a forked trace that couldn't be sent back, whose values
+        # are unknown rather than undefined
+        self.dropped_names = set()
 
-        if event == 'opcode':
-            if frame not in self._frame_analyzers:
-                self._frame_analyzers[frame] = FrameAnalyzer(frame)
-            analyzer = self._frame_analyzers[frame]
+    def _record_line(self, line):
+        self.execed_lines[line] += 1
 
-            instr = analyzer.current_instr()
-            name = instr.argval
+        if self.has_budget:
+            self.num_lines += 1
+            if (self.max_lines is not None
+                    and self.num_lines > self.max_lines) or (
+                        self.max_seconds is not None
+                        and time.perf_counter() > self._deadline):
+                raise TraceBudgetExceeded()
 
-            in_closure = frame.f_code.co_name != '<module>'
-            if instr.opname in self.write_instrs:
-                self.writes[name].append(
-                    IOEvent(line=frame.f_lineno, in_closure=in_closure))
-            elif instr.opname in self.read_instrs:
-                self.reads[name].append(
-                    IOEvent(line=frame.f_lineno, in_closure=in_closure))
+    def _truncate(self, exc):
+        self.truncated = True
 
+        # The outermost frame of the program is executing the top-level
+        # statement that was cut off
+        self.cutoff_line = 0
+        for frame, line in traceback.walk_tb(exc.__traceback__):
+            if frame.f_code.co_filename in self._fnames and \
+                    frame.f_code.co_name == '<module>':
+                self.cutoff_line = line
+                break
 
-        elif event == 'line':
-            self.execed_lines[frame.f_lineno] += 1
+    def _record_io(self, io_events, line, in_closure):
+        if self.aggregate_reads:
+            for (is_write, name) in io_events:
+                if is_write:
+                    self.io_summary.add_write(name, line)
+                else:
+                    self.io_summary.add_read(name, line, in_closure)
+            return
 
-        return self._trace_fn
+        for (is_write, name) in io_events:
+            events = self.writes if is_write else self.reads
+            events.append(name, line, in_closure)
+
+    def code_analyzer(self, code):
+        analyzer = self._code_analyzers.get(code)
+        if analyzer is None:
+            analyzer = self._code_analyzers[code] = CodeAnalyzer(code)
+        return analyzer
+
+    def reuse(self, tracer):
+        """
+        Adopts the results of an earlier trace of the same program instead of
+        executing it again.
+        """
+        self.execed_lines = tracer.execed_lines
+        self.reads = tracer.reads
+        self.writes = tracer.writes
+        self.io_summary = tracer.io_summary
+        self.truncated = tracer.truncated
+        self.cutoff_line = tracer.cutoff_line
+        self.globls = tracer.globls.copy()
+        self.dropped_names = tracer.dropped_names
+
+        # Functions defined by the program need its source to be inlined
+        self.sources = tracer.sources
+        for source in self.sources:
+            register_source(source)
+        return self
 
     def exec_counts(self) -> ExecCounts:
         assert self.trace_lines, "Tracer was not executed with trace_lines=True"
@@ -239,43 +1172,343 @@ class Tracer:
                                       unsafe_skip_copy=True)
         wrapper.visit(visitor)
 
+        # Any variable may be read by the part of a truncated program that
+        # wasn't executed
         unused_vars = visitor.unused_vars
         return {
-            self.node_map[k]: v
+            self.node_map[k]: v and not self.truncated
             for k, v in unused_vars.items() if k in self.node_map
         }
 
-    def trace(self):
+    def partial_nodes(self):
+        """
+        Nodes of the module whose exec counts may be incomplete because the
+        trace was truncated.
+        """
+        if not self.truncated:
+            return set()
+
+        visitor = PartialNodesVisitor(self.cutoff_line)
+        wrapper = cst.MetadataWrapper(self.transformed_module,
+                                      unsafe_skip_copy=True)
+        wrapper.visit(visitor)
+        return {
+            self.node_map[k]
+            for k in visitor.partial_nodes if k in self.node_map
+        }
+
+    def trace(self, incremental: Optional[IncrementalTrace] = None):
         """
         Execute the provided program.
 
         In order for introspection tools like inspect.getsource to work on top-level
-        objects, we have to actually write the code to a file and compile the code with
-        the filename.
+        objects, the code is compiled with a synthetic filename whose source is
+        registered in linecache.
+
+        If incremental checkpoints of an earlier version of the program are
+        provided, then the unchanged statements at its start are restored
+        instead of executed, and the checkpoints are updated.
         """
-        with NamedTemporaryFile(delete=False, prefix=TRACER_FILE_PREFIX) as f:
-            prog = self.transformed_module.code + '\n'
-            f.write(prog.encode('utf-8'))
-            f.flush()
-            self._fname = f.name
+        prog = self.transformed_module.code + '\n'
+        self._fname = register_source(prog)
+        self._fnames = {self._fname}
+        self.sources = [prog]
+        if self.max_seconds is not None:
+            self._deadline = time.perf_counter() + self.max_seconds
 
-            should_trace = self.trace_lines or self.trace_reads
+        if incremental is not None:
             try:
-                prog_bytecode = compile(prog, f.name, 'exec')
+                return self._trace_incremental(incremental)
+            except TraceBudgetExceeded as e:
+                self._truncate(e)
+                return self
+            except Exception:
+                print(prog)
+                raise
 
-                if should_trace:
-                    sys.settrace(self._trace_fn)
+        try:
+            prog_bytecode = compile(prog, self._fname, 'exec')
 
+            if self.observe_lines:
+                self.backend.start(self)
+                self.backend.add_code(prog_bytecode)
+
+            try:
                 # Can't seem to access local variables in a list comprehension?
                 # import x; [x.foo() for _ in range(10)]
                 # https://github.com/inducer/pudb/issues/103
                 # For now, just only use globals
                 exec(prog_bytecode, self.globls, self.globls)
+            finally:
+                if self.observe_lines:
+                    self.backend.stop()
+        except TraceBudgetExceeded as e:
+            self._truncate(e)
+        except Exception:
+            print(prog)
+            raise
 
-                if should_trace:
-                    sys.settrace(None)
+        return self
+
+    def trace_forked(self):
+        """
+        Execute the provided program in a forked child process, so its side
+        effects (changes to values in globls, open figures, allocated memory)
+        don't outlive the trace.
+
+        The child sends back the trace results and the globals that can be
+        pickled. Functions and classes defined by the program are recreated
+        from their code, bound to the new globals. Globals still bound to the
+        values passed to the tracer are kept as they are, and other globals
+        that can't be pickled are left out and recorded in dropped_names.
+        Without os.fork, or if a definition of the program can't be
+        recreated (e.g. a class with a metaclass or __slots__), the program
+        is executed in process.
+        """
+        if not hasattr(os, 'fork'):
+            return self.trace()
+
+        prog = self.transformed_module.code + '\n'
+        self._fname = register_source(prog)
+        self._fnames = {self._fname}
+        self.sources = [prog]
+
+        # Output buffered before the fork would be written by both processes
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 0
+            try:
+                with os.fdopen(write_fd, 'wb') as f:
+                    pickle.dump(self._forked_results(), f,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+            except BaseException:
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        if not data:
+            raise RuntimeError('Traced process exited without sending results')
+
+        error, results = pickle.loads(data)
+        if error is not None:
+            raise error
+        if results is None:
+            return self.trace()
+
+        # Definitions of the program are recreated, bound to the new globals
+        globls = {}
+        packed = results['globls']
+
+        def load_global(name):
+            if name not in globls:
+                value = packed[name]
+                if value is None:
+                    globls[name] = self.globls[name]
+                else:
+                    globls[name] = _unpack(
+                        ProgramUnpickler(io.BytesIO(value), globls,
+                                         load_global).load(),
+                        globls)
+            return globls[name]
+
+        try:
+            for name in packed:
+                load_global(name)
+        except Exception:
+            return self.trace()
+
+        self.execed_lines = results['execed_lines']
+        self.reads = results['reads']
+        self.writes = results['writes']
+        self.io_summary = results['io_summary']
+        self.truncated = results['truncated']
+        self.cutoff_line = results['cutoff_line']
+        self.globls = globls
+        self.dropped_names = results['dropped_names']
+        return self
+
+    def _forked_results(self):
+        base_globls = self.globls.copy()
+        try:
+            self.trace()
+        except BaseException as e:
+            try:
+                pickle.dumps(e)
+                error = e
             except Exception:
-                print(prog)
-                raise
+                error = RuntimeError(''.join(
+                    traceback.format_exception(type(e), e, e.__traceback__)))
+            return error, None
+
+        # None marks a value passed to the tracer, which the parent has too.
+        # If a definition of the program can't be sent, no results are sent
+        # so the parent traces the program itself, since passes couldn't
+        # inline the definition otherwise.
+        module = self.globls.get('__name__', 'builtins')
+        names = ProgramPickler.global_names(self.globls, module)
+        globls = {}
+        dropped_names = set()
+        for name, value in self.globls.items():
+            if name in base_globls and value is base_globls[name]:
+                globls[name] = None
+                continue
+            f = io.BytesIO()
+            try:
+                ProgramPickler(f, module, names).dump_global(name, value)
+            except Exception:
+                if id(value) in names or id(type(value)) in names:
+                    return None, None
+                dropped_names.add(name)
+                continue
+            globls[name] = f.getvalue()
+
+        return None, {
+            'execed_lines': self.execed_lines,
+            'reads': self.reads,
+            'writes': self.writes,
+            'io_summary': self.io_summary,
+            'truncated': self.truncated,
+            'cutoff_line': self.cutoff_line,
+            'globls': globls,
+            'dropped_names': dropped_names
+        }
+
+    def _statement_keys(self):
+        module = self.transformed_module
+        line = sum(module.code_for_node(empty).count('\n')
+                   for empty in module.header)
+        keys = []
+        for stmt in module.body:
+            source = module.code_for_node(stmt)
+            keys.append((line, source))
+            line += source.count('\n')
+        return keys
+
+    def _trace_incremental(self, state):
+        prog = self.sources[0]
+        keys = self._statement_keys()
+        start = state.resume_point(keys)
+        checkpoints = state.checkpoints[:start]
+
+        # Events of the restored statements are truncated from the last
+        # trace, which can't be done with a summary
+        self.aggregate_reads = False
+
+        globls = state.globls
+        globls.clear()
+        latent = set()
+        if start > 0:
+            restored = checkpoints[-1]
+            globls.update(restored.globls)
+            self.reads = state.reads.prefix(restored.num_reads)
+            self.writes = state.writes.prefix(restored.num_writes)
+            for checkpoint in checkpoints:
+                for line, count in checkpoint.lines.items():
+                    self.execed_lines[line] += count
+                latent |= checkpoint.effects.latent
+        else:
+            globls.update(self.globls)
+        self.globls = globls
+
+        # Functions defined by restored statements were compiled from an
+        # earlier version of the program, with the same line numbers
+        for checkpoint in checkpoints:
+            if checkpoint.program not in self.sources:
+                self.sources.append(checkpoint.program)
+                register_source(checkpoint.program)
+        should_trace = self.observe_lines
+        if should_trace:
+            self.backend.start(self)
+            for checkpoint in checkpoints:
+                self._fnames.add(checkpoint.code.co_filename)
+                self.backend.add_code(checkpoint.code)
+
+        # Ids of the values that each executed statement may have changed,
+        # or None if it may have changed any value
+        changed_ids = []
+        needs_checkpoint = {}
+        execed_lines = self.execed_lines
+        try:
+            for stmt, key in zip(self.transformed_module.body[start:],
+                                 keys[start:]):
+                line, source = key
+                code = compile('\n' * line + source, self._fname, 'exec')
+                effects = StatementEffects()
+                stmt.visit(effects)
+                latent |= effects.latent
+
+                changed = effects.changed_names(globls, latent)
+                ids = {id(globls[name]) for name in changed if name in globls}
+
+                if should_trace:
+                    self.backend.add_code(code)
+                self.execed_lines = defaultdict(int)
+                exec(code, globls, globls)
+
+                changed = effects.changed_names(globls, latent)
+                ids |= {id(globls[name]) for name in changed if name in globls}
+                changed_ids.append(None if effects.dynamic else ids)
+
+                protected = set()
+                for name, value in globls.items():
+                    if value is state.base_globls.get(name):
+                        continue
+                    if id(value) not in needs_checkpoint:
+                        needs_checkpoint[id(value)] = (value,
+                                                       _needs_checkpoint(value))
+                    if needs_checkpoint[id(value)][1]:
+                        protected.add(id(value))
+
+                for line, count in self.execed_lines.items():
+                    execed_lines[line] += count
+                checkpoints.append(
+                    TraceCheckpoint(key, code, prog, effects, globls.copy(),
+                                    _fingerprint(globls, state.base_globls),
+                                    self.execed_lines, len(self.reads),
+                                    len(self.writes), protected))
+                self.execed_lines = execed_lines
+        except BaseException:
+            if self.execed_lines is not execed_lines:
+                for line, count in self.execed_lines.items():
+                    execed_lines[line] += count
+                self.execed_lines = execed_lines
+            self.globls = globls.copy()
+            state.reset()
+            raise
+        finally:
+            if should_trace:
+                self.backend.stop()
+
+        # Invalidate the checkpoints whose values may have been changed by a
+        # statement executed after them
+        later_ids = set()
+        for checkpoint, ids in zip(reversed(checkpoints[start:]),
+                                   reversed(changed_ids)):
+            if later_ids is None or checkpoint.protected & later_ids:
+                checkpoint.valid = False
+            later_ids = None if later_ids is None or ids is None \
+                else later_ids | ids
+        for checkpoint in checkpoints[:start]:
+            if later_ids is None or checkpoint.protected & later_ids:
+                checkpoint.valid = False
+
+        state.checkpoints = checkpoints
+        state.reads = self.reads
+        state.writes = self.writes
+        state.stats['executed'] += len(keys) - start
+        state.stats['restored'] += start
 
+        # state.globls is reused by the next trace
+        self.globls = globls.copy()
         return self
@@ -10,23 +10,32 @@ from libcst.metadata import ExpressionContext
 
 from .common import (SEP, a2s, get_function_locals, make_assign, make_dict,
                      make_index, make_list, make_string, parse_expr,
-                     parse_statement)
+                     parse_function, parse_statement)
 from .contexts import ctx_inliner, ctx_pass
 from .visitors import (ExpressionContextProviderBlock, RemoveFunctoolsWraps,
                        ReplaceReturn, ReplaceSuper, ReplaceYield,
-                       ScopeProviderFunction, collect_imports, rename)
+                       ScopeProviderFunction, bulk_rename, collect_imports)
 
 
-def rename_in_function(f_ast, src, dst):
+def rename_in_function(f_ast, targets):
+    if len(targets) == 0:
+        return f_ast
+
     mod = cst.Module(body=f_ast.body.body)
-    return f_ast.with_deep_changes(f_ast.body, body=rename(mod, src, dst).body)
+    return f_ast.with_deep_changes(f_ast.body,
+                                   body=bulk_rename(mod, targets).body)
+
+
+def unique_name(f_ast, name):
+    return f'{name}{SEP}{f_ast.name.value}'
 
 
-# Scope a variable name as unique to the function, and update any
-# references to it in the function
-def unique_and_rename(f_ast, name):
-    unique_name = f'{name}{SEP}{f_ast.name.value}'
-    return rename_in_function(f_ast, name, unique_name), unique_name
+# Scope variable names as unique to the function, and update any
+# references to them in the function. All names are renamed with a single
+# scope resolution.
+def unique_and_rename(f_ast, names):
+    targets = [(name, unique_name(f_ast, name)) for name in names]
+    return rename_in_function(f_ast, targets), [dst for _, dst in targets]
 
 
 def bind_arguments(f_ast, call_expr, new_stmts):
@@ -34,11 +43,13 @@ def bind_arguments(f_ast, call_expr, new_stmts):
 
     args_def = f_ast.params
 
+    # Arguments to rename in the function body, applied together at the end
+    renamed_args = []
+
     def bind_new_argument(k, v):
-        nonlocal f_ast
         # Add a binding from function argument to call argument
-        f_ast, uniq_k = unique_and_rename(f_ast, k)
-        stmt = make_assign(cst.Name(uniq_k), v)
+        renamed_args.append(k)
+        stmt = make_assign(cst.Name(unique_name(f_ast, k)), v)
         new_stmts.append(stmt)
 
     # If function is called with f(*args)
@@ -142,7 +153,8 @@ def bind_arguments(f_ast, call_expr, new_stmts):
     # arguments from the call_expr
     if (args_def.star_arg is not cst.MaybeSentinel.DEFAULT
             and not isinstance(args_def.star_arg, cst.ParamStar)):
-        f_ast, k = unique_and_rename(f_ast, args_def.star_arg.name.value)
+        renamed_args.append(args_def.star_arg.name.value)
+        k = unique_name(f_ast, args_def.star_arg.name.value)
         v = call_anon_args[:]
         if star_arg is not None:
             v += call_star_args
@@ -150,7 +162,8 @@ def bind_arguments(f_ast, call_expr, new_stmts):
 
     # Similarly for **kwargs in the function definition
     if args_def.star_kwarg is not None:
-        f_ast, k = unique_and_rename(f_ast, args_def.star_kwarg.name.value)
+        renamed_args.append(args_def.star_kwarg.name.value)
+        k = unique_name(f_ast, args_def.star_kwarg.name.value)
         items = call_kwargs.items()
         if star_kwarg is not None:
             items = itertools.chain(items, call_star_kwarg.items())
@@ -158,6 +171,7 @@ def bind_arguments(f_ast, call_expr, new_stmts):
             make_assign(cst.Name(k),
                         make_dict([(make_string(k), v) for k, v in items])))
 
+    f_ast, _ = unique_and_rename(f_ast, renamed_args)
     return f_ast
 
 
@@ -257,9 +271,9 @@ def inline_function(func_obj,
     pass_ = ctx_pass.get()
 
     if f_ast is None:
-        # Get the source code for the function
+        # Get the source code for the function and parse it into an AST
         try:
-            f_source = inspect.getsource(func_obj)
+            f_source, f_ast = parse_function(func_obj)
         except TypeError:
             print('Failed to get source of {}'.format(a2s(call)))
             raise
@@ -267,9 +281,6 @@ def inline_function(func_obj,
         # Record statistics about length of inlined source
         inliner.length_inlined += len(f_source.split('\n'))
 
-        # Then parse the function into an AST
-        f_ast = parse_statement(f_source)
-
     # Give the function a fresh name so it won't conflict with other calls to
     # the same function
     f_ast = f_ast.with_changes(name=cst.Name(pass_.fresh_var(f_ast.name.value)))
@@ -311,10 +322,11 @@ def inline_function(func_obj,
         f_ast, unsafe_skip_copy=True).resolve(ScopeProviderFunction)
     func_scope = scopes[f_ast.body]
 
-    for assgn in func_scope.assignments:
-        if m.matches(assgn.node, m.Name()):
-            var = assgn.node.value
-            f_ast = unique_and_rename(f_ast, var)
+    local_vars = [
+        assgn.node.value for assgn in func_scope.assignments
+        if m.matches(assgn.node, m.Name())
+    ]
+    f_ast, _ = unique_and_rename(f_ast, local_vars)
 
     # Add an explicit return None at the end to reify implicit return
     f_body = f_ast.body
@@ -478,7 +490,7 @@ def inline_generator(func_obj, call, ret_var):
       for i in l:
         print(i)
     """
-    f_ast = parse_statement(inspect.getsource(func_obj))
+    _, f_ast = parse_function(func_obj)
 
     # Initialize the list
     new_stmts = [parse_statement(f'{ret_var} = []')]
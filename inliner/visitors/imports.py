@@ -1,9 +1,13 @@
 from typing import Dict
+import hashlib
 import inspect
+import linecache
 
 import libcst as cst
 import libcst.matchers as m
+from libcst.helpers import get_full_name_for_node
 
+from ..cache import SOURCE_CACHE, DiskCache, source_mtime
 from ..common import parse_expr, parse_module, a2s
 
 
@@ -58,7 +62,41 @@ class CollectImports(cst.CSTVisitor):
             alias = cst.ImportAlias(name=alias.name, asname=alias.asname)
             self.imprts[name] = cst.ImportFrom(module=module, names=[alias])
 
-_IMPORT_CACHE = {}
+# Import maps persist across processes, since parsing a large module (e.g.
+# pandas.core.frame) takes seconds
+_IMPORT_DISK_CACHE = DiskCache('imports')
+
+
+def _dotted_name(name):
+    parts = name.split('.')
+    node = cst.Name(parts[0])
+    for part in parts[1:]:
+        node = cst.Attribute(value=node, attr=cst.Name(part))
+    return node
+
+
+def _serialize_import(imprt):
+    """
+    Compact form of an import from CollectImports: [module, name, asname],
+    where module is None for a plain import.
+    """
+    alias = imprt.names[0]
+    asname = alias.asname.name.value if alias.asname is not None else None
+    if isinstance(imprt, cst.Import):
+        return [None, get_full_name_for_node(alias.name), asname]
+    return [
+        get_full_name_for_node(imprt.module),
+        get_full_name_for_node(alias.name), asname
+    ]
+
+
+def _deserialize_import(module, name, asname):
+    alias = cst.ImportAlias(
+        name=_dotted_name(name),
+        asname=cst.AsName(name=cst.Name(asname)) if asname is not None else None)
+    if module is None:
+        return cst.Import(names=[alias])
+    return cst.ImportFrom(module=_dotted_name(module), names=[alias])
 
 
 def collect_imports(obj):
@@ -67,13 +105,41 @@ def collect_imports(obj):
         return []
 
     mod_name = mod.__name__
-    if mod_name in _IMPORT_CACHE:
-        return _IMPORT_CACHE[mod_name]
-
-    import_collector = CollectImports(mod=mod_name)
-    obj_mod = parse_module(open(inspect.getsourcefile(obj)).read())
-    obj_mod.visit(import_collector)
-    imprts = import_collector.imprts
-    _IMPORT_CACHE[mod_name] = imprts
-
+    path = inspect.getsourcefile(obj)
+
+    # Source that only lives in linecache (e.g. a traced program) has no
+    # mtime to validate an entry against, so it's keyed by its contents
+    key = (mod_name, path)
+    if source_mtime(path) is None:
+        source = ''.join(linecache.getlines(path))
+        key += (hashlib.sha1(source.encode('utf-8')).hexdigest(), )
+
+    imprts = SOURCE_CACHE.get('imports', key, path)
+    if imprts is not None:
+        return imprts
+
+    serialized = _IMPORT_DISK_CACHE.get(mod_name, path)
+    if serialized is not None:
+        imprts = {
+            name: _deserialize_import(*imprt)
+            for name, imprt in serialized.items()
+        }
+    else:
+        import_collector = CollectImports(mod=mod_name)
+        # Read through linecache so traced programs, which only exist in
+        # linecache, can be parsed too. The file may have been edited since
+        # linecache last read it.
+        linecache.checkcache(path)
+        obj_mod = parse_module(''.join(linecache.getlines(path)))
+        obj_mod.visit(import_collector)
+        imprts = import_collector.imprts
+        # Dotted imports (import a.b) are keyed by a Name node, which no
+        # lookup by name can match, so they aren't stored
+        _IMPORT_DISK_CACHE.set(
+            mod_name, path, {
+                name: _serialize_import(imprt)
+                for name, imprt in imprts.items() if isinstance(name, str)
+            })
+
+    SOURCE_CACHE.set('imports', key, path, imprts)
     return imprts
@@ -178,6 +178,14 @@ class InsertStatementsVisitor(ContextAwareTransformer, RemoveEmptyBlocks):
                 leading_lines=list(original_node.leading_lines) +
                 list(new_node.leading_lines))
 
+    def finalize_statement(self, stmt: cst.BaseStatement,
+                           inserted: bool) -> cst.BaseStatement:
+        """
+        Hook called on each statement right before it is added to its block,
+        either because it was inserted or because its leading lines changed.
+        """
+        return stmt
+
     def _visit_block(self) -> None:
         ctx = self._context()
         ctx.ctx_block.append(
@@ -257,16 +265,27 @@ class InsertStatementsVisitor(ContextAwareTransformer, RemoveEmptyBlocks):
             before_stmts = [
                 self._add_hanging_lines(ctx_stmt.before_stmts[0], ctx_block)
             ] + ctx_stmt.before_stmts[1:]
+            before_stmts = [
+                self.finalize_statement(stmt, inserted=True)
+                for stmt in before_stmts
+            ]
             ctx_block.new_body.extend(before_stmts)
             ctx_block.added_stmts.update(set(before_stmts))
 
         if should_insert:
-            final_node = self._add_hanging_lines(final_node, ctx_block)
+            if len(ctx_block.hanging_lines) > 0:
+                final_node = self.finalize_statement(
+                    self._add_hanging_lines(final_node, ctx_block),
+                    inserted=False)
             ctx_block.new_body.append(final_node)
 
         if len(ctx_stmt.after_stmts) > 0:
-            ctx_block.new_body.extend(ctx_stmt.after_stmts)
-            ctx_block.added_stmts.update(set(ctx_stmt.after_stmts))
+            after_stmts = [
+                self.finalize_statement(stmt, inserted=True)
+                for stmt in ctx_stmt.after_stmts
+            ]
+            ctx_block.new_body.extend(after_stmts)
+            ctx_block.added_stmts.update(set(after_stmts))
 
         return final_node
 
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    # Keep the tests from reading or writing the user's persistent caches
+    monkeypatch.setenv('INLINER_CACHE_DIR',
+                       str(tmp_path_factory.mktemp('inliner-cache')))
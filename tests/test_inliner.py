@@ -0,0 +1,665 @@
+import inspect
+import json
+import json.decoder
+import os
+import tempfile
+import time
+import tracemalloc
+
+import libcst as cst
+import pytest
+
+from inliner import Inliner
+from inliner.cache import SOURCE_CACHE, DiskCache, LRUCache, SourceCache
+from inliner.common import EvalException, has_duplicate_nodes, metadata_wrapper
+from inliner.contexts import ctx_inliner, ctx_pass
+from inliner.passes import fuse_passes
+from inliner.passes.clean_imports import CleanImportsPass
+from inliner.passes.copy_propagation import CopyPropagationPass
+from inliner.passes.deadcode import DeadCodePass
+from inliner.passes.inline import InlinePass
+from inliner.passes.unused_vars import UnusedVarsPass
+from inliner.targets import InlineTarget, TargetIndex, make_target
+from inliner.tracer import TracerArgs
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+
+    # 'b' was least recently used
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'size': 2, 'maxsize': 2}
+
+
+def test_inliner_trace_cache():
+    calls = []
+
+    def prog():
+        calls.append(1)
+        x = 1
+        assert x == 1
+
+    i = Inliner(prog)
+    i.run_pass(DeadCodePass)
+    i.run_pass(DeadCodePass)
+
+    # Second pass sees the same program, so it isn't re-executed
+    assert len(calls) == 1
+    assert i.trace_cache.hits == 1
+    assert i.trace_cache.misses == 1
+
+    # Different tracer arguments need a new trace
+    i.run_pass(UnusedVarsPass)
+    assert len(calls) == 2
+
+
+def test_inliner_trace_cache_globals():
+    calls = []
+
+    def prog():
+        calls.append(1)
+
+    i = Inliner(prog)
+    i.run_pass(DeadCodePass)
+
+    # Changing the globals invalidates the cached trace
+    i.base_globls['calls'] = calls = []
+    i.run_pass(DeadCodePass)
+    assert len(calls) == 1
+
+
+def test_inliner_trace_cache_eviction():
+    calls = []
+
+    def prog():
+        calls.append(1)
+
+    i = Inliner(prog, trace_cache_size=0)
+    i.run_pass(DeadCodePass)
+    i.run_pass(DeadCodePass)
+    assert len(calls) == 2
+
+
+def test_inliner_trace_plan():
+    calls = []
+
+    def prog():
+        calls.append(1)
+        x = 1
+        assert x == 1
+
+    i = Inliner(prog)
+    assert i.plan_tracer_args([DeadCodePass, UnusedVarsPass]) == TracerArgs(
+        trace_lines=True, trace_reads=True, aggregate_reads=True)
+
+    # Every pass in optimize shares one trace of the unchanged program
+    i.optimize()
+    assert len(calls) == 1
+
+
+def test_inliner_no_temp_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+
+    def target(x):
+        return x + 1
+
+    def prog():
+        def f(y):
+            return target(y)
+
+        assert f(1) == 2
+
+    i = Inliner(prog)
+    i.add_target(target)
+    i.optimize()
+
+    assert 'target_ret = y + 1' in i.code()
+    assert os.listdir(tmp_path) == []
+
+
+def test_function_cache():
+    def target(x):
+        return x + 1
+
+    def prog():
+        assert target(1) + target(2) == 5
+
+    SOURCE_CACHE.clear()
+    i = Inliner(prog)
+    i.add_target(target)
+    i.optimize()
+
+    # The second call site reuses the parsed definition from the first
+    assert SOURCE_CACHE.stats('function')['hits'] >= 1
+    assert SOURCE_CACHE.stats('function')['misses'] == 1
+    assert i.length_inlined == 2 * len(inspect.getsource(target).split('\n'))
+
+    # Each call site gets its own copy of the definition
+    i = Inliner(prog)
+    i.add_target(target)
+    i.run_pass(InlinePass)
+    assert not has_duplicate_nodes(i.module)
+
+
+def test_run_pass_changed():
+    def prog():
+        import sys
+        import os
+        x = 1
+        if x == 1:
+            y = 2
+        assert y == 2
+
+    i = Inliner(prog)
+    assert i.run_pass(DeadCodePass)
+    assert not i.run_pass(DeadCodePass)
+
+    # Imports are only a change if they weren't already sorted at the top
+    assert i.run_pass(CleanImportsPass)
+    assert not i.run_pass(CleanImportsPass)
+    assert i.code().startswith('import os\nimport sys\n')
+
+
+def test_run_passes_schedule():
+    def target(x):
+        y = x + 1
+        return y
+
+    def prog():
+        z = target(1)
+        assert z == 2
+
+    passes = [InlinePass, DeadCodePass, UnusedVarsPass, CleanImportsPass]
+
+    def fixpoint(i):
+        def run_round():
+            return any([i.run_pass(Pass) for Pass in passes])
+
+        return i.fixpoint(run_round)
+
+    expected = Inliner(prog)
+    expected.add_target(target)
+    assert fixpoint(expected)
+
+    i = Inliner(prog)
+    i.add_target(target)
+    assert i.run_passes(passes)
+    assert i.code() == expected.code()
+
+    # Passes that nothing could have re-enabled are skipped
+    assert i.scheduler_stats['saved'] > 0
+
+
+def test_profiler():
+    def prog():
+        x = 1
+        if x == 1:
+            y = 2
+        assert y == 2
+
+    i = Inliner(prog, profile=True)
+    i.run_pass(DeadCodePass)
+    i.run_pass(DeadCodePass)
+
+    first, second = i.profiler.records
+    assert first.pass_name == 'dead_code' and first.changed
+    assert not second.changed
+    assert first.nodes_visited > 0
+    assert first.trace_time > 0
+    assert first.total_time >= first.transform_time
+
+    table = i.profiler.table()
+    assert table.splitlines()[0].split() == [
+        'pass', 'total', 'trace', 'metadata', 'transform', 'trim', 'nodes',
+        'changed', 'evals', 'eval', 'hits'
+    ]
+    assert len(table.splitlines()) == 2
+    assert Inliner(prog).profiler is None
+
+
+def test_pass_timings():
+    def prog():
+        time.sleep(0.05)
+
+    # Repeated executes of a pass only subtract the time of their own trace
+    i = Inliner(prog, trace_cache_size=0)
+    with ctx_inliner.set(i):
+        pass_ = DeadCodePass()
+        with ctx_pass.set(pass_):
+            pass_.execute(i.module)
+            pass_.execute(i.module)
+    assert pass_.timings['trace'] >= 0.1
+    assert 0 <= pass_.timings['transform'] < 0.05
+
+
+def test_fuse_passes():
+    Fused = fuse_passes(UnusedVarsPass, CleanImportsPass)
+    assert Fused is fuse_passes(UnusedVarsPass, CleanImportsPass)
+    assert Fused.pass_names() == ('unused_vars', 'clean_imports')
+    assert Fused.tracer_args == UnusedVarsPass.tracer_args
+
+    def prog():
+        x = 1
+        import sys
+        y = 2
+        import os
+        assert y == 2
+
+    i = Inliner(prog)
+    assert i.run_pass(Fused)
+    assert i.code() == 'import os\nimport sys\ny = 2\nassert y == 2'
+    assert not i.run_pass(Fused)
+
+    # Passes overriding the same visitor methods can't be combined
+    with pytest.raises(AssertionError):
+        fuse_passes(DeadCodePass, CleanImportsPass)
+
+
+def test_has_duplicate_nodes():
+    mod = cst.parse_module('x = 1\ny = x + x\n')
+    assert not has_duplicate_nodes(mod)
+
+    one = cst.Integer('1')
+    dup = mod.with_changes(body=[
+        cst.SimpleStatementLine([cst.Expr(cst.BinaryOperation(
+            left=one, operator=cst.Add(), right=one))])
+    ])
+    assert has_duplicate_nodes(dup)
+    assert metadata_wrapper(dup).module is not dup
+    assert metadata_wrapper(mod).module is mod
+
+
+def test_copy_propagation_no_duplicates():
+    def prog():
+        x = 1
+        y = x
+        assert y + y == 2
+
+    i = Inliner(prog)
+    i.run_pass(CopyPropagationPass)
+    assert i.code() == 'x = 1\nassert x + x == 2'
+    assert not has_duplicate_nodes(i.module)
+
+
+def test_metadata_cache():
+    def prog():
+        x = 1
+        assert x == 1
+
+    i = Inliner(prog)
+    i.run_pass(DeadCodePass)
+    module = i.module
+
+    # Passes that don't change the module keep it, and share its metadata
+    assert not i.run_pass(DeadCodePass)
+    assert not i.run_pass(UnusedVarsPass)
+    assert i.module is module
+    assert i.metadata_cache.hits == 2
+
+
+def test_incremental_trace():
+    calls = []
+
+    def setup():
+        calls.append(1)
+        return 1
+
+    def target(x):
+        y = x + 1
+        return y
+
+    def prog():
+        x = setup()
+        z = target(x)
+        assert z == 2
+
+    expected = Inliner(prog)
+    expected.add_target(target)
+    expected.optimize()
+    num_calls = len(calls)
+
+    i = Inliner(prog, incremental_trace=True)
+    i.add_target(target)
+    i.optimize()
+    assert i.code() == expected.code()
+
+    # setup() is only executed again after the statement calling it changed
+    assert len(calls) - num_calls < num_calls
+    ((_, state), ) = i.incremental_traces.values()
+    assert state.stats['restored'] > 0
+
+
+def test_incremental_trace_aliases():
+    def prog():
+        def f(x):
+            return x + 1
+
+        data = [[]]
+        first = data[0]
+        first.append(f(1))
+        if len(data[0]) > 1:
+            y = 'wrong'
+        else:
+            y = 'right'
+        assert y == 'right'
+
+    i = Inliner(prog, incremental_trace=True)
+    i.optimize()
+    assert "'wrong'" not in i.code()
+    i.execute()
+
+
+def test_setup_statements():
+    calls = []
+
+    def setup():
+        calls.append(1)
+        return 1
+
+    def target(x):
+        y = x + 1
+        return y
+
+    def prog():
+        x = setup()
+        z = target(x)
+        assert z == 2
+
+    i = Inliner(prog, setup_statements=1)
+    i.add_target(target)
+    i.optimize()
+
+    # Setup was executed once, and is kept as is at the start of the program
+    assert len(calls) == 1
+    assert i.code().startswith('x = setup()\n')
+    assert 'y = x + 1' in i.module.code
+
+
+@pytest.mark.parametrize('copyable', [True, False])
+def test_setup_statements_isolated(copyable, caplog):
+    class Handle:
+        def __deepcopy__(self, memo):
+            if not copyable:
+                raise TypeError("can't copy a handle")
+            return Handle()
+
+    def prog():
+        data = []
+        handle = Handle()
+        data.append(handle)
+        assert len(data) == 1
+
+    # Every trace starts from the values defined by setup, not the ones
+    # changed by the previous trace
+    i = Inliner(prog, setup_statements=2)
+    i.optimize()
+    assert len(i.base_globls['data']) == 0
+    assert i.code().startswith('data = []\nhandle = Handle()\n')
+    i.execute()
+    i.execute()
+
+    # A value that can't be copied makes every trace execute setup again
+    assert ("Setup value handle can't be copied"
+            in caplog.text) == (not copyable)
+
+
+def test_setup_statements_shared():
+    def target(x):
+        y = x + 1
+        return y
+
+    def prog():
+        data = bytearray(10**7)
+        z = target(len(data))
+
+    i = Inliner(prog, setup_statements=1)
+    i.add_target(target)
+
+    # Values that the program only reads are shared by every trace instead
+    # of being copied and kept alive by the trace cache
+    tracemalloc.start()
+    i.optimize()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(i.trace_cache) > 1
+    assert peak < 10**6
+
+
+def test_setup_statements_aliases():
+    def prog():
+        rows = [[]]
+        for row in rows:
+            row.append(1)
+        assert rows == [[1]]
+
+    i = Inliner(prog, setup_statements=1)
+    rows = i.base_globls['rows']
+    i.optimize()
+
+    # The loop changed the shared list in place, so setup was executed
+    # again and the list is copied from then on
+    assert rows == [[1]]
+    assert i.base_globls['rows'] == [[]]
+    assert i.mutated_setup_names == {'rows'}
+    i.execute()
+    i.execute()
+    assert i.base_globls['rows'] == [[]]
+
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_fork_trace():
+    p = """
+def f(x):
+    y = x + 1
+    return y
+
+z = f(1)
+assert z == 2
+"""
+    expected = Inliner(p)
+    expected.optimize()
+
+    i = Inliner(p, fork_trace=True)
+    i.optimize()
+    assert 'def f' not in i.code()
+    assert i.code() == expected.code()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_fork_trace_dropped_values():
+    p = """
+import threading
+open = threading.Lock()
+"""
+    i = Inliner(p, fork_trace=True)
+    tracer = i.trace(i.module, TracerArgs())
+    assert 'open' not in tracer.globls
+
+    # A value that couldn't be sent back isn't the builtin of the same name
+    with pytest.raises(EvalException):
+        i.eval('open', tracer.globls, tracer.dropped_names)
+
+
+def test_trace_budget():
+    def prog():
+        x = 0
+        if x == 0:
+            y = 1
+        for i in range(1000000):
+            if i > 10:
+                z = 2
+
+    i = Inliner(prog, max_trace_lines=20)
+    i.run_pass(DeadCodePass)
+
+    # The branch that wasn't taken before the cutoff is kept
+    assert 'if x == 0' not in i.code()
+    assert 'z = 2' in i.code()
+
+
+def test_eval_cache():
+    def target(x):
+        return x + 1
+
+    def prog():
+        y = target(1)
+        z = target(y)
+
+    i = Inliner(prog, profile=True)
+    i.add_target(target)
+    i.run_pass(InlinePass)
+
+    # Both calls evaluate `target`, which is only compiled once
+    assert i.expression_codes.stats()['hits'] >= 1
+    (record, ) = i.profiler.records
+    assert record.evals == i.expression_codes.hits + i.expression_codes.misses
+    assert record.eval_hits == i.expression_codes.hits
+    assert i.profiler.table().splitlines()[1].split()[-1].endswith('%')
+
+
+def test_should_inline_memo():
+    class CountingTarget(InlineTarget):
+        def __init__(self, depends_on_code):
+            super().__init__(None)
+            self.calls = 0
+            self._depends_on_code = depends_on_code
+
+        def should_inline(self, code, obj):
+            self.calls += 1
+            return False
+
+        def depends_on_code(self, obj):
+            return self._depends_on_code
+
+    def f(x):
+        return x
+
+    decoder = json.JSONDecoder()
+
+    def prog():
+        a = f(1)
+        b = f(2)
+        c = f(3)
+
+        # Each access creates a new bound method
+        d = decoder.decode('1')
+        e = decoder.decode('2')
+
+    i = Inliner(prog)
+    by_obj = i.add_target(CountingTarget(False))
+    by_code = i.add_target(CountingTarget(True))
+    assert i.targets_version == 2
+
+    # Decided once each for f, decoder and decoder.decode
+    i.run_pass(InlinePass)
+    assert by_obj.calls == 3
+    assert by_code.calls == 7
+
+
+def test_target_index():
+    index = TargetIndex()
+    json_target = make_target('json')
+    decoder_target = make_target('json.decoder')
+    dumps_target = make_target(json.dumps)
+    for target in [json_target, decoder_target, dumps_target]:
+        index.add(target)
+
+    assert index.should_inline(None, json.decoder.JSONDecoder)
+    assert index.should_inline(None, json.dumps)
+    assert not index.should_inline(None, os.path.join)
+
+    index.remove(json_target)
+    assert index.should_inline(None, json.decoder.JSONDecoder)
+    assert not index.should_inline(None, json.loads)
+
+    # dumps is still matched by identity
+    assert index.should_inline(None, json.dumps)
+    index.remove(dumps_target)
+    assert not index.should_inline(None, json.dumps)
+
+    index.remove(decoder_target)
+    assert index.module_trie == {}
+
+
+def test_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('INLINER_CACHE_DIR', str(tmp_path / 'cache'))
+    source = tmp_path / 'source.py'
+    source.write_text('x = 1\n')
+
+    cache = DiskCache('test')
+    assert cache.get('a', str(source)) is None
+    cache.set('a', str(source), {'x': [None, 'x', None]})
+    assert cache.get('a', str(source)) == {'x': [None, 'x', None]}
+
+    # Entries are invalidated when their source changes, even if its size
+    # and mtime stay the same
+    stat = os.stat(source)
+    source.write_text('x = 2\n')
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.get('a', str(source)) is None
+    source.write_text('x = 2\ny = 3\n')
+    assert cache.get('a', str(source)) is None
+
+    # Source that isn't on disk isn't cached
+    cache.set('b', '<inline-0>', {})
+    assert cache.get('b', '<inline-0>') is None
+
+    # The least recently used entries are evicted past max_bytes
+    cache.max_bytes = 1
+    cache.set('a', str(source), {})
+    cache.set('c', str(source), {})
+    assert len(os.listdir(tmp_path / 'cache' / 'test')) == 1
+    assert cache.get('c', str(source)) == {}
+
+
+def test_source_cache(tmp_path):
+    source = tmp_path / 'source.py'
+    source.write_text('x = 1\n')
+
+    cache = SourceCache(maxsize=2)
+    assert cache.get('function', 'a', str(source)) is None
+    cache.set('function', 'a', str(source), 1)
+    assert cache.get('function', 'a', str(source)) == 1
+
+    # Entries are invalidated when their source changes
+    os.utime(source, (0, 0))
+    assert cache.get('function', 'a', str(source)) is None
+    assert cache.stats('function') == {'hits': 1, 'misses': 2}
+    assert cache.stats()['invalidations'] == 1
+    assert len(cache) == 0
+
+    # Kinds don't share keys, but do share the bound
+    cache.set('function', 'a', str(source), 1)
+    cache.set('imports', 'a', str(source), 2)
+    assert cache.get('imports', 'a', str(source)) == 2
+    cache.set('imports', 'b', str(source), 3)
+    assert cache.get('function', 'a', str(source)) is None
+    assert cache.stats()['size'] == 2
+
+
+def test_clear_caches():
+    def target(x):
+        return x + 1
+
+    def prog():
+        assert target(1) == 2
+
+    i = Inliner(prog)
+    i.add_target(target)
+    i.optimize()
+    stats = i.cache_stats()
+    assert stats['source']['kinds']['function']['misses'] >= 1
+    assert stats['trace']['size'] > 0
+
+    i.clear_caches()
+    stats = i.cache_stats()
+    assert stats['source']['size'] == 0
+    assert stats['trace']['size'] == 0
+    assert stats['expressions']['size'] == 0
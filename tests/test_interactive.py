@@ -1,6 +1,6 @@
 from inliner import InteractiveInliner
 from inliner.targets import FunctionTarget
-from inliner.tracer import Tracer
+from inliner.tracer import Tracer, register_source
 from inliner.common import parse_module
 
 import os
@@ -78,3 +78,38 @@ i.execute()"""
     print(i.debug())
     assert i.debug() == debug_str.strip()
     Tracer(parse_module(debug_str), globls=globals()).trace()
+
+
+def test_interactive_debug_setup():
+    def prog():
+        data = []
+        data.append(json.dumps({}))
+        assert data == ['{}']
+
+    i = InteractiveInliner(prog, setup_statements=1)
+    i.add_target(FunctionTarget(json.dumps))
+    assert i.run_pass('inline')
+
+    debug_str = i.debug()
+    assert 'data = []\n' in debug_str
+    assert 'i = InteractiveInliner(f, setup_statements=1)' in debug_str
+    Tracer(parse_module(debug_str), globls=globals()).trace()
+
+
+def test_interactive_evicted_source(monkeypatch):
+    monkeypatch.setattr('inliner.tracer.MAX_REGISTERED_SOURCES', 2)
+
+    def prog():
+        def f(x):
+            return x + 1
+
+        assert f(1) == 2
+
+    i = InteractiveInliner(prog)
+    i.target_suggestions()
+
+    # Other programs traced in the meantime push the source out of linecache
+    for n in range(3):
+        register_source(f'x = {n}\n')
+    assert i.run_pass('inline')
+    i.execute()
@@ -1,5 +1,20 @@
-from inliner.tracer import Tracer, InsertDummyTransformer, TracerArgs
+from inliner.tracer import (Tracer, InsertDummyTransformer, TracerArgs,
+                            SettraceBackend, MonitoringBackend, IOEvent,
+                            IOEventStore, IncrementalTrace, UnusedVarsVisitor,
+                            register_source)
 import libcst as cst
+import inspect
+import linecache
+import os
+import random
+import sys
+from types import SimpleNamespace
+from pytest import mark, raises
+
+# On Python 3.12+, sys.settrace opcode events are unreliable, which is what
+# the sys.monitoring backend is for
+BACKENDS = [MonitoringBackend] if hasattr(sys,
+                                          'monitoring') else [SettraceBackend]
 
 
 def test_tracer_basic():
@@ -11,6 +26,38 @@ assert x == 1
     assert t.globls['x'] == 1
 
 
+def test_register_source(monkeypatch):
+    monkeypatch.setattr('inliner.tracer.MAX_REGISTERED_SOURCES', 2)
+    a = register_source('a = 1\n')
+    b = register_source('b = 1\n')
+    assert linecache.getlines(a) == ['a = 1\n']
+
+    # The least recently registered source is removed from linecache
+    register_source('a = 1\n')
+    c = register_source('c = 1\n')
+    assert a in linecache.cache and c in linecache.cache
+    assert b not in linecache.cache
+
+    # A reused trace registers the source of its program again
+    t = Tracer(cst.parse_module('def f():\n    pass\n')).trace()
+    register_source('d = 1\n')
+    register_source('e = 1\n')
+    with raises(OSError):
+        inspect.getsource(t.globls['f'])
+    reused = Tracer(t.module).reuse(t)
+    assert inspect.getsource(reused.globls['f']) == 'def f():\n    pass\n'
+
+    # So does an incremental trace for the restored statements
+    state = IncrementalTrace()
+    p = 'def f():\n    pass\nx = 1\n'
+    Tracer(cst.parse_module(p)).trace(incremental=state)
+    register_source('d = 1\n')
+    register_source('e = 1\n')
+    t = Tracer(cst.parse_module(p.replace('1', '2'))).trace(incremental=state)
+    assert state.stats['restored'] == 1
+    assert inspect.getsource(t.globls['f']) == 'def f():\n    pass\n'
+
+
 def test_tracer_insert_dummy():
     p = """
 for x in range(10):
@@ -80,3 +127,419 @@ for x in range(10):
     assert exec_counts[loop_body.body[0]] == 10
     assert exec_counts[loop_body.body[0].body] == 5
     assert exec_counts[loop_body.body[1]] == 10
+
+
+@mark.parametrize('Backend', BACKENDS)
+def test_tracer_backend(Backend):
+    p = """
+def f(y):
+    return x + y
+
+x = 1
+for i in range(3):
+    x = f(i)
+"""
+
+    mod = cst.parse_module(p)
+    tracer = Tracer(mod,
+                    args=TracerArgs(trace_lines=True, trace_reads=True),
+                    backend=Backend()).trace()
+
+    # Line numbers refer to the transformed module, which has a __name__
+    # statement at the start of the loop body
+    assert tracer.globls['x'] == 4
+    assert tracer.execed_lines[3] == 3
+    assert tracer.execed_lines[8] == 3
+    assert [e.line for e in tracer.writes['x']] == [5, 8, 8, 8]
+    assert [e.line for e in tracer.reads['f']] == [8, 8, 8]
+    assert all(e.in_closure for e in tracer.reads['y'])
+    assert not any(e.in_closure for e in tracer.reads['i'])
+
+
+@mark.parametrize('Backend', BACKENDS)
+def test_tracer_backend_same_line_loop(Backend):
+    p = """
+x = 0
+while x < 3: x += 1
+"""
+
+    mod = cst.parse_module(p)
+    tracer = Tracer(mod, args=TracerArgs(trace_lines=True),
+                    backend=Backend()).trace()
+
+    # Before Python 3.10, settrace also reports a line event for the final,
+    # failing loop test
+    expected = 4 if Backend is SettraceBackend and \
+        sys.version_info < (3, 10) else 3
+    assert tracer.execed_lines[3] == expected
+
+
+def test_tracer_getsource():
+    p = """
+def f(x):
+    return x + 1
+"""
+
+    t = Tracer(cst.parse_module(p)).trace()
+    assert inspect.getsource(t.globls['f']) == "def f(x):\n    return x + 1\n"
+
+
+def test_tracer_code_analyzers():
+    p = """
+import weakref
+
+class Obj:
+    pass
+
+refs = []
+def f(i):
+    obj = Obj()
+    refs.append(weakref.ref(obj))
+    return i
+
+for i in range(100):
+    f(i)
+"""
+
+    tracer = Tracer(cst.parse_module(p),
+                    args=TracerArgs(trace_reads=True)).trace()
+
+    # One analyzer per code object (module, class body, function) rather
+    # than per frame, and finished frames don't keep their locals alive
+    assert len(tracer._code_analyzers) <= 3
+    assert all(ref() is None for ref in tracer.globls['refs'])
+    assert len(tracer.writes['obj']) == 100
+
+
+def test_io_event_store():
+    store = IOEventStore()
+    store.append('x', 3, False)
+    store.append('y', 4, True)
+    store.append('x', 5, True)
+
+    assert store['x'] == [IOEvent(line=3, in_closure=False),
+                          IOEvent(line=5, in_closure=True)]
+    assert list(store.lines('y')) == [4]
+    assert store['z'] == [] and 'z' not in store
+    assert store.keys() == ['x', 'y']
+    assert len(store) == 3
+
+    # Appending after a query invalidates the index
+    store.append('y', 6, False)
+    assert [e.line for e in store['y']] == [4, 6]
+
+
+def test_tracer_aggregate_reads():
+    p = """
+x = 1
+y = 0
+for i in range(1000):
+    x = i
+    y = x + y
+x = 2
+z = y
+def f():
+    return z
+f()
+"""
+
+    module = cst.parse_module(p)
+    full = Tracer(module, args=TracerArgs(trace_reads=True)).trace()
+    agg = Tracer(module,
+                 args=TracerArgs(trace_reads=True,
+                                 aggregate_reads=True)).trace()
+
+    assert agg.unused_vars() == full.unused_vars()
+
+    # Only distinct lines are kept, however many times the loop runs
+    assert len(agg.writes) == 0
+    assert len(agg.io_summary.next_writes['x']) == 3
+    assert 'z' in agg.io_summary.closure_reads
+
+
+def test_tracer_args_union():
+    agg = TracerArgs(trace_reads=True, aggregate_reads=True)
+    assert agg.union(TracerArgs(trace_lines=True)).aggregate_reads
+    assert not agg.union(TracerArgs(trace_reads=True)).aggregate_reads
+    assert not TracerArgs(aggregate_reads=True).union(
+        TracerArgs()).aggregate_reads
+
+
+def reference_unused_lines(writes, reads):
+    unused_lines = set()
+    for k, ws in writes.items():
+        rs = reads[k]
+        for i, cur_write in enumerate(ws):
+            next_write_line = min(
+                [w.line for w in ws[i + 1:] if w.line > cur_write.line],
+                default=sys.maxsize)
+            if not any((cur_write.line < r.line <= next_write_line)
+                       or r.in_closure for r in rs):
+                unused_lines.add(cur_write.line)
+    return unused_lines
+
+
+def test_unused_lines_matches_reference():
+    rng = random.Random(0)
+    for _ in range(500):
+        writes, reads = IOEventStore(), IOEventStore()
+        for _ in range(rng.randrange(1, 30)):
+            events = writes if rng.random() < 0.6 else reads
+            events.append(rng.choice('ab'), rng.randrange(10),
+                          rng.random() < 0.05)
+
+        tracer = SimpleNamespace(aggregate_reads=False,
+                                 writes=writes,
+                                 reads=reads)
+        assert UnusedVarsVisitor(tracer).unused_lines == \
+            reference_unused_lines(writes, reads)
+
+
+@mark.parametrize('Backend', BACKENDS)
+def test_tracer_incremental(Backend):
+    calls = []
+
+    def setup():
+        calls.append(1)
+        return 10
+
+    p = """x = setup()
+def f(a):
+    b = a + x
+    return b
+y = f(1)
+z = y * 2
+"""
+    globls = {'setup': setup}
+    args = TracerArgs(trace_lines=True, trace_reads=True)
+    state = IncrementalTrace(globls)
+    for prog in [p, p.replace('z = y * 2', 'z = f(y) * 3\nw = z')]:
+        t = Tracer(cst.parse_module(prog), globls, args,
+                   backend=Backend()).trace(incremental=state)
+        expected = Tracer(cst.parse_module(prog), globls, args,
+                          backend=Backend()).trace()
+        assert dict(t.execed_lines) == dict(expected.execed_lines)
+        assert t.reads.items() == expected.reads.items()
+        assert t.writes.items() == expected.writes.items()
+        assert t.globls['z'] == expected.globls['z']
+
+    # The unchanged statements, including setup(), were restored
+    assert state.stats['restored'] == 3
+    assert len(calls) == 3
+
+
+def test_tracer_incremental_side_effects():
+    p = """
+data = [1]
+data.append(2)
+n = len(data)
+"""
+    state = IncrementalTrace()
+
+    def trace(prog):
+        return Tracer(cst.parse_module(prog)).trace(incremental=state).globls
+
+    assert trace(p)['data'] == [1, 2]
+
+    # The list after the first statement was changed by the second one
+    assert [c.valid for c in state.checkpoints] == [False, True, True, True]
+
+    globls = trace(p.replace('len(data)', 'len(data) + 0'))
+    assert state.stats['restored'] == 2
+    assert globls['n'] == 2
+
+    globls = trace(p.replace('append(2)', 'append(3)'))
+    assert state.stats['restored'] == 2
+    assert globls['data'] == [1, 3]
+
+
+def test_tracer_incremental_aliases():
+    state = IncrementalTrace()
+
+    def trace(prog):
+        return Tracer(cst.parse_module(prog)).trace(incremental=state).globls
+
+    # The nested lists are changed through the loop variable
+    p = """
+data = [[], []]
+for row in data:
+    row.append(1)
+"""
+    assert trace(p)['data'] == [[1], [1]]
+    assert trace(p.replace('append(1)', 'append(2)'))['data'] == [[2], [2]]
+    assert state.stats['restored'] == 0
+
+    # and through another name for the nested list
+    p = """
+data = [[]]
+first = data[0]
+first.append(1)
+n = len(data[0])
+"""
+    assert trace(p)['n'] == 1
+    p = p.replace('append(1)', 'append(2)')
+    assert trace(p)['data'] == [[2]]
+    assert state.stats['restored'] == 0
+
+    # Checkpoints after the last change can still be restored
+    assert trace(p.replace('len(data[0])', 'len(first)'))['n'] == 1
+    assert state.stats['restored'] == 3
+
+
+def test_tracer_incremental_library_call():
+    p = """
+import bisect
+data = [1]
+bisect.insort(data, 0)
+"""
+    state = IncrementalTrace()
+
+    def trace(prog):
+        return Tracer(cst.parse_module(prog)).trace(incremental=state).globls
+
+    assert trace(p)['data'] == [0, 1]
+
+    # insort may have changed its arguments, so the list is built again
+    globls = trace(p.replace('insort(data, 0)', 'insort(data, 5)'))
+    assert globls['data'] == [1, 5]
+
+    p = p.replace('import bisect', 'from bisect import insort')
+    p = p.replace('bisect.insort', 'insort')
+    assert trace(p)['data'] == [0, 1]
+    assert trace(p.replace('insort(data, 0)', 'insort(data, 5)'))['data'] == \
+        [1, 5]
+
+
+@mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_tracer_forked():
+    p = """
+log.append(1)
+x = len(log)
+f = lambda: x
+for i in range(3):
+    y = i
+"""
+    log = []
+    globls = {'log': log}
+    args = TracerArgs(trace_lines=True, trace_reads=True)
+    t = Tracer(cst.parse_module(p), globls, args).trace_forked()
+    expected = Tracer(cst.parse_module(p), {'log': []}, args).trace()
+
+    # The program's changes to the globals stay in the child process
+    assert log == []
+    assert t.globls['log'] is log
+    assert t.globls['x'] == 1
+    assert t.globls['f']() == 1
+
+    assert dict(t.execed_lines) == dict(expected.execed_lines)
+    assert t.reads.items() == expected.reads.items()
+    assert t.writes.items() == expected.writes.items()
+
+
+@mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_tracer_forked_definitions():
+    p = """
+class Base:
+    def get(self):
+        return 1
+
+class A(Base):
+    def get(self):
+        return super().get() + 1
+
+    @staticmethod
+    def make():
+        return A()
+
+def f(x, cls=Base):
+    return cls().get() + x
+
+def adder(y):
+    return lambda x: x + y
+
+a = A.make()
+fs = [f, adder(1)]
+"""
+    t = Tracer(cst.parse_module(p)).trace_forked()
+    globls = t.globls
+
+    # Definitions of the program are recreated in the parent process
+    assert globls['f'](1) == 2
+    assert globls['f'].__globals__ is globls
+    assert globls['f'].__defaults__[0] is globls['Base']
+    assert type(globls['a']) is globls['A']
+    assert globls['a'].get() == 2
+    assert globls['fs'][0] is globls['f']
+    assert globls['fs'][1](1) == 2
+    assert inspect.getsource(globls['f']).startswith('def f(x, cls=Base):')
+
+    # Programs with definitions that can't be sent back are traced in process
+    definitions = [
+        'class A(abc.ABC):\n    pass\n',
+        'class A(enum.Enum):\n    X = 1\n',
+        'class A:\n    __slots__ = ("x", )\n',
+        'class A:\n    pass\n\na = A()\na.gen = (i for i in range(3))\n',
+    ]
+    for definition in definitions:
+        log = []
+        p = f'import abc\nimport enum\n{definition}log.append(1)\n'
+        t = Tracer(cst.parse_module(p), {'log': log}).trace_forked()
+        assert log == [1]
+        assert inspect.isclass(t.globls['A'])
+
+    # Other values that can't be sent back are unknown
+    p = """
+import threading
+open = threading.Lock()
+x = 1
+"""
+    t = Tracer(cst.parse_module(p)).trace_forked()
+    assert t.globls['x'] == 1
+    assert t.dropped_names == {'threading', 'open'}
+
+
+@mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_tracer_forked_error():
+    t = Tracer(cst.parse_module('assert False, "oops"'))
+    with raises(AssertionError, match='oops'):
+        t.trace_forked()
+
+
+@mark.parametrize('Backend', BACKENDS)
+def test_tracer_budget(Backend):
+    p = """
+x = 0
+while True:
+    x += 1
+"""
+    t = Tracer(cst.parse_module(p),
+               args=TracerArgs(trace_lines=True, max_lines=100),
+               backend=Backend()).trace()
+    assert t.truncated
+    assert sum(t.execed_lines.values()) <= 101
+
+    # The cutoff is somewhere in the loop (lines 3-5 once the tracer adds a
+    # dummy statement), depending on the interpreter, and everything from the
+    # loop on is partial
+    assign, loop = t.module.body
+    assert 3 <= t.cutoff_line <= 5
+    partial = t.partial_nodes()
+    assert loop in partial and loop.body in partial
+    assert assign not in partial
+
+    t = Tracer(cst.parse_module(p),
+               args=TracerArgs(max_seconds=0.05),
+               backend=Backend()).trace()
+    assert t.truncated
+    assert t.globls['x'] > 0
+
+    t = Tracer(cst.parse_module('x = 1'), args=TracerArgs(max_lines=100),
+               backend=Backend()).trace()
+    assert not t.truncated
+
+    # y could be read after the cutoff
+    t = Tracer(cst.parse_module('y = 1' + p),
+               args=TracerArgs(trace_reads=True, max_lines=100),
+               backend=Backend()).trace()
+    assert t.truncated
+    assert not any(t.unused_vars().values())
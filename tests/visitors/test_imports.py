@@ -0,0 +1,67 @@
+import json.decoder
+import os
+
+import libcst as cst
+
+from inliner import Inliner
+from inliner.cache import SOURCE_CACHE
+from inliner.contexts import ctx_inliner
+from inliner.tracer import Tracer
+from inliner.visitors import imports
+
+
+def test_collect_imports_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('INLINER_CACHE_DIR', str(tmp_path))
+    SOURCE_CACHE.clear()
+
+    def code(imprts):
+        return {
+            name: cst.Module([]).code_for_node(imprt)
+            for name, imprt in imprts.items() if isinstance(name, str)
+        }
+
+    with ctx_inliner.set(Inliner('x = 1')):
+        parsed = imports.collect_imports(json.decoder.JSONDecoder)
+
+        # A new process would only have the imports on disk
+        SOURCE_CACHE.clear()
+        hits = imports._IMPORT_DISK_CACHE.hits
+        loaded = imports.collect_imports(json.decoder.JSONDecoder)
+
+    assert imports._IMPORT_DISK_CACHE.hits == hits + 1
+    assert code(loaded) == code(parsed)
+    assert code(loaded)['scanner'] == 'from json import scanner'
+
+
+def test_collect_imports_invalidation(tmp_path, monkeypatch):
+    monkeypatch.setenv('INLINER_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    source = tmp_path / 'edited_module.py'
+    source.write_text('import os\n\ndef f():\n    pass\n')
+    import edited_module
+
+    with ctx_inliner.set(Inliner('x = 1')):
+        assert list(imports.collect_imports(edited_module.f)) == ['os']
+        assert list(imports.collect_imports(edited_module.f)) == ['os']
+
+        # An edited module is parsed again
+        source.write_text('import sys\n\ndef f():\n    pass\n')
+        os.utime(source, (0, 0))
+        assert list(imports.collect_imports(edited_module.f)) == ['sys']
+
+    assert SOURCE_CACHE.stats('imports')['hits'] >= 1
+
+
+def test_collect_imports_linecache_source():
+    # Programs traced with the globals of a module are part of that module
+    def f(prog):
+        tracer = Tracer(cst.parse_module(prog), {'__name__': __name__})
+        return tracer.trace().globls['f']
+
+    v1 = f('import os\ndef f():\n    pass\n')
+    v2 = f('import sys\ndef f():\n    pass\n')
+    assert v1.__module__ == v2.__module__ == __name__
+    with ctx_inliner.set(Inliner('x = 1')):
+        assert list(imports.collect_imports(v1)) == ['os']
+        assert list(imports.collect_imports(v2)) == ['sys']
+        assert list(imports.collect_imports(v1)) == ['os']